@@ -0,0 +1,94 @@
+""" Measures the throughput ceiling of the audio stream read loop, without any network involved
+
+    python benchmarks/stream_read.py --size 256 --chunk-size 20000
+"""
+import argparse
+import time
+
+from zotify.stream import StreamCopier
+
+
+class MemoryStream:
+    """ Serves a payload through read() the way librespot's decrypted stream does, returning new bytes """
+
+    def __init__(self, payload: bytes):
+        self.payload = memoryview(payload)
+        self.position = 0
+
+    def read(self, size: int) -> bytes:
+        data = self.payload[self.position:self.position + size].tobytes()
+        self.position += len(data)
+        return data
+
+
+class ReadintoMemoryStream(MemoryStream):
+    """Same source, also able to fill a caller's buffer.
+
+    librespot's streams do not offer readinto, so this only shows what a source that does would gain.
+    """
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), len(self.payload) - self.position)
+        buffer[:n] = self.payload[self.position:self.position + n]
+        self.position += n
+        return n
+
+
+class NullSink:
+    def write(self, data) -> int:
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+class CountingBar:
+    """ Stands in for tqdm, counting calls since each of them costs a lock and a clock read """
+
+    def __init__(self):
+        self.calls = 0
+
+    def update(self, n: int) -> None:
+        self.calls += 1
+
+
+def legacy_loop(source, sink, p_bar, chunk_size: int) -> int:
+    """ The loop download_track used before StreamCopier """
+    downloaded = 0
+    b = 0
+    while b < 5:
+        data = source.read(chunk_size)
+        p_bar.update(sink.write(data))
+        downloaded += len(data)
+        b += 1 if data == b'' else 0
+    return downloaded
+
+
+def run(name: str, func, size: int) -> None:
+    p_bar = CountingBar()
+    start = time.perf_counter()
+    copied = func(p_bar)
+    elapsed = time.perf_counter() - start
+    assert copied == size, f'{name} copied {copied} of {size} bytes'
+    print(f'{name:<44} {size / elapsed / 1024 / 1024:10.1f} MiB/s   {p_bar.calls:8d} progress updates')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=256, help='payload size in MiB')
+    parser.add_argument('--chunk-size', type=int, default=20000, help='CHUNK_SIZE to start from')
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    payload = bytes(size)
+
+    run('legacy read loop', lambda p_bar: legacy_loop(MemoryStream(payload), NullSink(), p_bar, args.chunk_size), size)
+    run('StreamCopier, read()', lambda p_bar: StreamCopier(MemoryStream(payload), NullSink(), args.chunk_size)
+        .copy(p_bar, size, max_empty_reads=5), size)
+    # hypothetical source, every stream zotify copies in production goes through read()
+    run('StreamCopier, readinto() (in-memory only)', lambda p_bar: StreamCopier(ReadintoMemoryStream(payload), NullSink(), args.chunk_size)
+        .copy(p_bar, size, max_empty_reads=5), size)
+
+
+if __name__ == '__main__':
+    main()
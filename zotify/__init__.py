@@ -24,7 +24,9 @@ from librespot.core import (
 from librespot.mercury import MercuryClient
 from librespot.proto import Authentication_pb2 as Authentication
 from pkce import generate_code_verifier, get_code_challenge
-from requests import HTTPError, get, post
+from requests import HTTPError, post
+
+from zotify.network import HttpClient
 
 
 API_URL = "https://api.sp" + "otify.com/v1/"
@@ -210,7 +212,7 @@ class ApiClient(LibrespotApiClient):
         params["limit"] = limit
         params["offset"] = offset
 
-        response = get(API_URL + url, headers=headers, params=params)
+        response = HttpClient.get(API_URL + url, headers=headers, params=params)
         data = response.json()
 
         try:
@@ -1,6 +1,12 @@
-from zotify.const import ITEMS, ARTISTS, NAME, ID, DISC_NUMBER
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from zotify.const import ALBUMS, ARTISTS, NAME, ID, DISC_NUMBER, TRACKS, ALBUM, IS_PLAYABLE
+from zotify.metadata import MetadataStore
+from zotify.paginator import Paginator, PAGE_WORKERS
+from zotify.scheduler import DownloadPool, StreamPrefetcher
 from zotify.termoutput import Printer
-from zotify.track import download_track
+from zotify.track import download_track, will_download
 from zotify.utils import fix_filename
 from zotify.zotify import Zotify
 
@@ -10,39 +16,48 @@ ARTIST_URL = 'https://api.spot'+'ify.com/v1/artists'
 
 def get_album_info(album_id):
     """ Returns album info and tracklist"""
+    return MetadataStore.get(ALBUMS, album_id, lambda: fetch_album_info(album_id))
+
+
+def fetch_album_info(album_id):
+    """ Fetches album info and tracklist, use get_album_info to reuse an earlier lookup """
     
-    (raw, resp) = Zotify.invoke_url(f'{ALBUM_URL}/{album_id}')
+    (raw, resp) = Zotify.invoke_url(f'{ALBUM_URL}/{album_id}?market=from_token')
     
     album_name = fix_filename(resp[NAME])
     album_artist = resp[ARTISTS][0][NAME]
     
-    songs = []
-    offset = 0
-    limit = 50
+    # the album object already holds the first page of its tracklist
+    songs = list(Paginator(f'{ALBUM_URL}/{album_id}/tracks', limit=50, first_page=resp[TRACKS], market='from_token'))
     
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{ALBUM_URL}/{album_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
+    # album tracks are simplified track objects, attach the album to get the full objects download_track needs
+    album = {k: v for k, v in resp.items() if k != TRACKS}
+    MetadataStore.add_tracks({song[ID]: {**song, ALBUM: album} for song in songs if IS_PLAYABLE in song})
     
     total_discs = songs[-1][DISC_NUMBER]
     
     return album_name, album_artist, songs, total_discs
 
 
+def get_artist_album_objects(artist_id) -> list[dict]:
+    """ Returns artist's albums, singles and EPs as simplified album objects """
+    return list(Paginator(f'{ARTIST_URL}/{artist_id}/albums', limit=50, include_groups='album,single'))
+
+
 def get_artist_albums(artist_id):
     """ Returns artist's albums """
-    (raw, resp) = Zotify.invoke_url(f'{ARTIST_URL}/{artist_id}/albums?include_groups=album%2Csingle')
-    # Return a list each album's id
-    album_ids = [resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))]
-    # Recursive requests to get all albums including singles an EPs
-    while resp['next'] is not None:
-        (raw, resp) = Zotify.invoke_url(resp['next'])
-        album_ids.extend([resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))])
+    return [album[ID] for album in get_artist_album_objects(artist_id)]
 
-    return album_ids
+
+def get_artists_albums(artist_ids: list[str]) -> list[dict]:
+    """ Returns the albums of every given artist, listing albums shared between artists only once """
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix='zotify-artists') as executor:
+        album_lists = list(executor.map(get_artist_album_objects, artist_ids))
+    
+    albums = {}
+    for album in chain.from_iterable(album_lists):
+        albums.setdefault(album[ID], album)
+    return list(albums.values())
 
 
 def download_album(album, wrapper_p_bars: list | None = None, M3U8_bypass: str | None = None):
@@ -57,11 +72,17 @@ def download_album(album, wrapper_p_bars: list | None = None, M3U8_bypass: str |
             if type(bar) != int: bar.refresh()
     else:
         wrapper_p_bars = []
-    p_bar = Printer.progress(enumerate(tracks, start=1), unit_scale=True, unit='songs', total=len(tracks), 
+    # albums downloading side by side (e.g. --followed) each get their own rows
+    pos = DownloadPool.bar_position(pos, wrapper_p_bars, rows=2)
+    p_bar = Printer.progress(unit_scale=True, unit='songs', total=len(tracks), 
                              disable=not Zotify.CONFIG.get_show_album_pbar(), pos=pos)        
     wrapper_p_bars.append(p_bar if Zotify.CONFIG.get_show_album_pbar() else pos)
     
-    for n, track in p_bar:
+    # only tracks get_album_info could not build from the album object are fetched
+    MetadataStore.prefetch_tracks([track[ID] for track in tracks])
+    
+    album_keys = {}
+    for n, track in enumerate(tracks, start=1):
         
         extra_keys={'album_num': str(n).zfill(char_num), 
                     'album_artist': album_artist, 
@@ -72,17 +93,21 @@ def download_album(album, wrapper_p_bars: list | None = None, M3U8_bypass: str |
         if M3U8_bypass is not None:
             extra_keys['M3U8_bypass'] = M3U8_bypass
         
-        download_track('album', track[ID], 
-                       extra_keys=extra_keys,
-                       wrapper_p_bars=wrapper_p_bars)
-        p_bar.set_description(track[NAME])
-        for bar in wrapper_p_bars:
-            if type(bar) != int: bar.refresh()
+        album_keys[track[ID]] = extra_keys
+    
+    with StreamPrefetcher([track[ID] for track in tracks], lambda track_id: will_download('album', track_id, album_keys[track_id])), \
+            DownloadPool(p_bar, wrapper_p_bars) as pool:
+        for track in tracks:
+            # download_track pops M3U8_bypass, the prefetcher still reads the keys
+            extra_keys = dict(album_keys[track[ID]])
+            pool.submit(track[NAME], download_track, 'album', track[ID], 
+                        extra_keys=extra_keys,
+                        wrapper_p_bars=wrapper_p_bars)
 
 
 def download_artist_albums(artist, wrapper_p_bars: list | None = None):
     """ Downloads albums of an artist """
-    albums = get_artist_albums(artist)
+    albums = get_artist_album_objects(artist)
     
     pos = 5
     if wrapper_p_bars is not None:
@@ -95,8 +120,8 @@ def download_artist_albums(artist, wrapper_p_bars: list | None = None):
                              disable=not Zotify.CONFIG.get_show_artist_pbar(), pos=pos)        
     wrapper_p_bars.append(p_bar if Zotify.CONFIG.get_show_artist_pbar() else pos)
     
-    for album_id in p_bar:
-        download_album(album_id, wrapper_p_bars)
-        p_bar.set_description(get_album_info(album_id)[0])
+    for album in p_bar:
+        download_album(album[ID], wrapper_p_bars)
+        p_bar.set_description(fix_filename(album[NAME]))
         for bar in wrapper_p_bars:
             if type(bar) != int: bar.refresh()
@@ -3,13 +3,16 @@ from librespot.audio.decoders import AudioQuality
 from tabulate import tabulate
 from pathlib import Path
 
-from zotify.album import download_album, download_artist_albums
+from zotify.album import download_album, download_artist_albums, get_artists_albums
 from zotify.const import TRACK, NAME, ID, ARTIST, ARTISTS, ITEMS, TRACKS, EXPLICIT, ALBUM, ALBUMS, \
     OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME
+from zotify.metadata import MetadataStore
 from zotify.playlist import get_playlist_info, download_from_user_playlist, download_playlist
 from zotify.podcast import download_episode, download_show
+from zotify.scheduler import DownloadPool, PostProcessor, StreamPrefetcher
 from zotify.termoutput import Printer, PrintChannel
-from zotify.track import download_track, get_saved_tracks, get_followed_artists
+from zotify.track import download_track, will_download, get_saved_tracks, get_new_saved_tracks, set_saved_tracks_synced, \
+    get_followed_artists
 from zotify.utils import splash, split_input, regex_input_for_urls
 from zotify.zotify import Zotify
 
@@ -57,36 +60,49 @@ def client(args: Namespace) -> None:
         return
     
     if args.liked_songs:
-        liked_songs = get_saved_tracks()
+        if Zotify.CONFIG.get_sync_liked_songs():
+            new_songs = get_new_saved_tracks()
+            total, pages = len(new_songs), [new_songs]
+        else:
+            liked_songs = get_saved_tracks()
+            # downloads of the first pages start while later ones are still being fetched
+            total, pages = liked_songs.total, liked_songs.pages()
         
         pos = 3
-        p_bar = Printer.progress(liked_songs, unit='songs', total=len(liked_songs), unit_scale=True, 
+        p_bar = Printer.progress(unit='songs', total=total, unit_scale=True, 
                                  disable=not Zotify.CONFIG.get_show_playlist_pbar(), pos=pos)
         wrapper_p_bars = [p_bar if Zotify.CONFIG.get_show_playlist_pbar() else pos]
         
-        for song in p_bar:
-            if not song[TRACK][NAME] or not song[TRACK][ID]:
-                Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###')
-                Printer.print(PrintChannel.SKIPS, '\n\n')
-            else:
-                download_track('liked', song[TRACK][ID], wrapper_p_bars=wrapper_p_bars)
-                p_bar.set_description(song[TRACK][NAME])
-            for bar in wrapper_p_bars:
-                if type(bar) != int: bar.refresh()
+        with StreamPrefetcher(wanted=lambda track_id: will_download('liked', track_id)) as prefetcher, DownloadPool(p_bar, wrapper_p_bars) as pool:
+            for page in pages:
+                MetadataStore.prefetch_tracks([song[TRACK][ID] for song in page])
+                prefetcher.extend([song[TRACK][ID] for song in page if song[TRACK][NAME] and song[TRACK][ID]])
+                for song in page:
+                    if not song[TRACK][NAME] or not song[TRACK][ID]:
+                        Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###')
+                        Printer.print(PrintChannel.SKIPS, '\n\n')
+                        p_bar.update(1)
+                    else:
+                        pool.submit(song[TRACK][NAME], download_track, 'liked', song[TRACK][ID], wrapper_p_bars=wrapper_p_bars)
+        
+        if Zotify.CONFIG.get_sync_liked_songs():
+            # failures are only known once post-processing of every song has finished
+            PostProcessor.wait()
+            set_saved_tracks_synced(new_songs)
         return
     
     if args.followed_artists:
         artists = get_followed_artists()
+        # one plan for every followed artist, albums shared between them are downloaded once
+        albums = get_artists_albums([artist[ID] for artist in artists])
         pos = 7
-        p_bar = Printer.progress(artists, unit='artists', total=len(artists), unit_scale=True, 
+        p_bar = Printer.progress(unit='albums', total=len(albums), unit_scale=True, 
                                  disable=not Zotify.CONFIG.get_show_url_pbar(), pos=pos)
         wrapper_p_bars = [p_bar if Zotify.CONFIG.get_show_url_pbar() else pos]
         
-        for artist in p_bar:
-            download_artist_albums(artist[ID], wrapper_p_bars)
-            p_bar.set_description(artist[NAME])
-            for bar in wrapper_p_bars:
-                if type(bar) != int: bar.refresh()
+        with DownloadPool(p_bar, wrapper_p_bars) as pool:
+            for album in albums:
+                pool.submit(album[NAME], download_album, album[ID], list(wrapper_p_bars))
         return
     
     if args.search:
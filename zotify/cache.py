@@ -0,0 +1,105 @@
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+
+from zotify.network import HttpClient
+from zotify.zotify import Zotify
+
+
+COVER_CACHE_BYTES = 64 * 1024 * 1024
+COVER_CACHE_DIR = 'covers'
+
+
+class CoverArtCache:
+    """Cover images keyed by URL, so an album's cover is downloaded once instead of once per track.
+
+    Images are kept in an in-memory LRU bounded by COVER_CACHE_BYTES and, with CACHE_LOCATION set,
+    in a covers directory that later runs read from.
+    """
+    _images: OrderedDict[str, bytes] = OrderedDict()
+    _size = 0
+    _lock = Lock()
+    _fetching: dict[str, Lock] = {}
+    _written_jpgs: set[Path] = set()
+
+    @classmethod
+    def get(cls, image_url: str) -> bytes:
+        with cls._lock:
+            img = cls._lookup(image_url)
+            if img is not None:
+                return img
+            url_lock = cls._fetching.setdefault(image_url, Lock())
+
+        # concurrent workers of one album wait for the first fetch instead of repeating it
+        with url_lock:
+            try:
+                with cls._lock:
+                    img = cls._lookup(image_url)
+                if img is None:
+                    img = cls._read_disk(image_url)
+                if img is None:
+                    response = HttpClient.get(image_url)
+                    # an error page must never end up embedded as artwork or cached on disk
+                    response.raise_for_status()
+                    # jpeg format expected from request
+                    img = response.content
+                    cls._write_disk(image_url, img)
+                with cls._lock:
+                    cls._store(image_url, img)
+            finally:
+                with cls._lock:
+                    cls._fetching.pop(image_url, None)
+        return img
+
+    @classmethod
+    def write_jpg(cls, jpg_path: Path, img: bytes) -> None:
+        """ Saves a cover next to the tracks, at most once per path and run """
+        with cls._lock:
+            if jpg_path in cls._written_jpgs:
+                return
+            cls._written_jpgs.add(jpg_path)
+        if not jpg_path.exists():
+            with open(jpg_path, 'wb') as jpg_file:
+                jpg_file.write(img)
+
+    @classmethod
+    def _lookup(cls, image_url: str) -> bytes | None:
+        img = cls._images.get(image_url)
+        if img is not None:
+            cls._images.move_to_end(image_url)
+        return img
+
+    @classmethod
+    def _store(cls, image_url: str, img: bytes) -> None:
+        if image_url in cls._images or len(img) > COVER_CACHE_BYTES:
+            return
+        cls._images[image_url] = img
+        cls._size += len(img)
+        while cls._size > COVER_CACHE_BYTES:
+            _, evicted = cls._images.popitem(last=False)
+            cls._size -= len(evicted)
+
+    @staticmethod
+    def _disk_path(image_url: str) -> Path | None:
+        cache_dir = Zotify.CONFIG.get_cache_location()
+        if cache_dir is None:
+            return None
+        return Path(cache_dir) / COVER_CACHE_DIR / (hashlib.sha1(image_url.encode()).hexdigest() + '.jpg')
+
+    @classmethod
+    def _read_disk(cls, image_url: str) -> bytes | None:
+        path = cls._disk_path(image_url)
+        if path is None or not path.is_file():
+            return None
+        return path.read_bytes()
+
+    @classmethod
+    def _write_disk(cls, image_url: str, img: bytes) -> None:
+        path = cls._disk_path(image_url)
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix('.tmp')
+        temp_path.write_bytes(img)
+        temp_path.replace(path)
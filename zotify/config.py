@@ -59,6 +59,18 @@ ALWAYS_CHECK_LYRICS = 'ALWAYS_CHECK_LYRICS'
 M3U8_LOCATION = 'M3U8_LOCATION'
 M3U8_REL_PATHS = 'M3U8_REL_PATHS'
 DOWNLOAD_PARENT_ALBUM = 'DOWNLOAD_PARENT_ALBUM'
+DOWNLOAD_WORKERS = 'DOWNLOAD_WORKERS'
+TRANSCODE_WORKERS = 'TRANSCODE_WORKERS'
+STREAM_CONVERSION = 'STREAM_CONVERSION'
+ADAPTIVE_RATE_LIMIT = 'ADAPTIVE_RATE_LIMIT'
+CACHE_LOCATION = 'CACHE_LOCATION'
+ARTIST_CACHE_TTL = 'ARTIST_CACHE_TTL'
+HTTP_CACHE = 'HTTP_CACHE'
+HTTP_CACHE_SIZE = 'HTTP_CACHE_SIZE'
+PODCAST_SEGMENTS = 'PODCAST_SEGMENTS'
+STREAM_PREFETCH = 'STREAM_PREFETCH'
+SYNC_PLAYLISTS = 'SYNC_PLAYLISTS'
+SYNC_LIKED_SONGS = 'SYNC_LIKED_SONGS'
 
 
 CONFIG_VALUES = {
@@ -104,12 +116,24 @@ CONFIG_VALUES = {
     MD_GENREDELIMITER:          { 'default': ', ',                      'type': str,    'arg': ('--md-genredelimiter'                    ,) },
     MD_ARTISTDELIMITER:         { 'default': ', ',                      'type': str,    'arg': ('--md-artistdelimiter'                   ,) },
     MD_SAVE_LYRICS:             { 'default': 'True',                    'type': bool,   'arg': ('--md-save-lyrics'                       ,) },
+    CACHE_LOCATION:             { 'default': '',                        'type': str,    'arg': ('--cache-location'                       ,) },
+    ARTIST_CACHE_TTL:           { 'default': '168',                     'type': int,    'arg': ('--artist-cache-ttl'                     ,) },
+    HTTP_CACHE:                 { 'default': 'False',                   'type': bool,   'arg': ('--http-cache'                           ,) },
+    HTTP_CACHE_SIZE:            { 'default': '256',                     'type': int,    'arg': ('--http-cache-size'                      ,) },
     SKIP_EXISTING:              { 'default': 'True',                    'type': bool,   'arg': ('-ie', '--skip-existing'                 ,) },
     SKIP_PREVIOUSLY_DOWNLOADED: { 'default': 'False',                   'type': bool,   'arg': ('-ip', '--skip-previously-downloaded'    ,) },
+    SYNC_PLAYLISTS:             { 'default': 'False',                   'type': bool,   'arg': ('--sync-playlists'                       ,) },
+    SYNC_LIKED_SONGS:           { 'default': 'False',                   'type': bool,   'arg': ('--sync-liked-songs'                     ,) },
     DOWNLOAD_PARENT_ALBUM:      { 'default': 'False',                   'type': bool,   'arg': ('--download-parent-album'                ,) },
     RETRY_ATTEMPTS:             { 'default': '1',                       'type': int,    'arg': ('--retry-attempts'                       ,) },
     BULK_WAIT_TIME:             { 'default': '31',                       'type': int,    'arg': ('--bulk-wait-time'                       ,) },
+    ADAPTIVE_RATE_LIMIT:        { 'default': 'False',                   'type': bool,   'arg': ('--adaptive-rate-limit'                  ,) },
     OVERRIDE_AUTO_WAIT:         { 'default': 'False',                   'type': bool,   'arg': ('--override-auto-wait'                   ,) },
+    DOWNLOAD_WORKERS:           { 'default': '1',                       'type': int,    'arg': ('--workers', '--download-workers'        ,) },
+    TRANSCODE_WORKERS:          { 'default': '0',                       'type': int,    'arg': ('--transcode-workers'                    ,) },
+    STREAM_PREFETCH:            { 'default': '0',                       'type': int,    'arg': ('--stream-prefetch'                      ,) },
+    STREAM_CONVERSION:          { 'default': 'False',                   'type': bool,   'arg': ('--stream-conversion'                    ,) },
+    PODCAST_SEGMENTS:           { 'default': '1',                       'type': int,    'arg': ('--podcast-segments'                     ,) },
     CHUNK_SIZE:                 { 'default': '20000',                   'type': int,    'arg': ('--chunk-size'                           ,) },
     DOWNLOAD_REAL_TIME:         { 'default': 'False',                   'type': bool,   'arg': ('-rt', '--download-real-time'            ,) },
     LANGUAGE:                   { 'default': 'en',                      'type': str,    'arg': ('--language'                             ,) },
@@ -467,4 +491,61 @@ class Config:
     @classmethod
     def get_download_parent_album(cls) -> bool:
         return cls.get(DOWNLOAD_PARENT_ALBUM)
-    
\ No newline at end of file
+    
+    @classmethod
+    def get_download_workers(cls) -> int:
+        return cls.get(DOWNLOAD_WORKERS)
+    
+    @classmethod
+    def get_transcode_workers(cls) -> int:
+        return cls.get(TRANSCODE_WORKERS)
+    
+    @classmethod
+    def get_cache_location(cls) -> PurePath | None:
+        if cls.get(CACHE_LOCATION) == '':
+            # Persistent caches are disabled
+            return None
+        else:
+            cache_path = cls.get(CACHE_LOCATION)
+            if cache_path[0] == ".":
+                cache_path = cls.get_root_path() / PurePath(cache_path).relative_to(".")
+            cache_path = PurePath(Path(cache_path).expanduser())
+        
+        Path(cache_path).mkdir(parents=True, exist_ok=True)
+        return cache_path
+    
+    @classmethod
+    def get_artist_cache_ttl(cls) -> int:
+        return cls.get(ARTIST_CACHE_TTL)
+    
+    @classmethod
+    def get_stream_conversion(cls) -> bool:
+        return cls.get(STREAM_CONVERSION)
+    
+    @classmethod
+    def get_adaptive_rate_limit(cls) -> bool:
+        return cls.get(ADAPTIVE_RATE_LIMIT)
+    
+    @classmethod
+    def get_sync_playlists(cls) -> bool:
+        return cls.get(SYNC_PLAYLISTS)
+    
+    @classmethod
+    def get_sync_liked_songs(cls) -> bool:
+        return cls.get(SYNC_LIKED_SONGS)
+    
+    @classmethod
+    def get_http_cache(cls) -> bool:
+        return cls.get(HTTP_CACHE)
+    
+    @classmethod
+    def get_http_cache_size(cls) -> int:
+        return cls.get(HTTP_CACHE_SIZE)
+    
+    @classmethod
+    def get_podcast_segments(cls) -> int:
+        return cls.get(PODCAST_SEGMENTS)
+    
+    @classmethod
+    def get_stream_prefetch(cls) -> int:
+        return cls.get(STREAM_PREFETCH)
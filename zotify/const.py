@@ -4,6 +4,8 @@ SAVED_TRACKS_URL = 'https://api.spot'+'ify.com/v1/me/tracks'
 
 TRACKS_URL = 'https://api.spot'+'ify.com/v1/tracks'
 
+ARTISTS_URL = 'https://api.spot'+'ify.com/v1/artists'
+
 TRACK_STATS_URL = 'https://api.spot'+'ify.com/v1/audio-features/'
 
 TRACKNUMBER = 'tracknumber'
@@ -40,6 +42,8 @@ TRACKS = 'tracks'
 
 TRACK = 'track'
 
+EPISODE = 'episode'
+
 ITEMS = 'items'
 
 NAME = 'name'
@@ -58,6 +62,14 @@ LIMIT = 'limit'
 
 OFFSET = 'offset'
 
+TOTAL = 'total'
+
+NEXT = 'next'
+
+SNAPSHOT_ID = 'snapshot_id'
+
+ADDED_AT = 'added_at'
+
 AUTHORIZATION = 'Authorization'
 
 IS_PLAYABLE = 'is_playable'
@@ -0,0 +1,206 @@
+import json
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+
+from zotify.const import TRACKS, TRACKS_URL, ARTISTS, ARTISTS_URL, GENRES, ID, ERROR, NAME, ALBUM, ALBUM_TYPE, \
+    COMPILATION, RELEASE_DATE, DISC_NUMBER, TRACK_NUMBER, TOTAL_TRACKS, IS_PLAYABLE, DURATION_MS, IMAGES, WIDTH, URL
+from zotify.zotify import Zotify
+
+
+TRACKS_BATCH_SIZE = 50
+ARTISTS_BATCH_SIZE = 50
+ARTIST_CACHE_FILE = 'artists.json'
+FETCHED = 'fetched'
+
+
+@dataclass
+class TrackMetadata:
+    """The fields of a track that the download pipeline needs, read once from its Web API track object.
+
+    Genres, lyrics and the disc total are filled in by download_track before the track is handed
+    to post-processing, which may run in another process.
+    """
+    id: str
+    name: str
+    artists: list[str]
+    raw_artists: list[dict]
+    album_name: str
+    album_artist: str
+    image_url: str
+    release_year: str
+    disc_number: int
+    track_number: int
+    total_tracks: int
+    compilation: int
+    is_playable: bool
+    duration_ms: int
+    total_discs: int | None = None
+    genres: list[str] = field(default_factory=list)
+    lyrics: list[str] | None = None
+
+    @property
+    def duration(self) -> float:
+        """ Duration in seconds """
+        return self.duration_ms / 1000
+
+    @classmethod
+    def from_track(cls, track: dict) -> 'TrackMetadata':
+        image = max(track[ALBUM][IMAGES], key=lambda i: i[WIDTH])
+        return cls(
+            id=track[ID],
+            name=track[NAME],
+            artists=[data[NAME] for data in track[ARTISTS]],
+            raw_artists=track[ARTISTS],
+            album_name=track[ALBUM][NAME],
+            album_artist=track[ALBUM][ARTISTS][0][NAME],
+            image_url=image[URL],
+            release_year=track[ALBUM][RELEASE_DATE].split('-')[0],
+            disc_number=track[DISC_NUMBER],
+            track_number=track[TRACK_NUMBER],
+            total_tracks=track[ALBUM][TOTAL_TRACKS],
+            compilation=1 if COMPILATION in track[ALBUM][ALBUM_TYPE] else 0,
+            is_playable=track[IS_PLAYABLE],
+            duration_ms=track[DURATION_MS],
+        )
+
+
+class MetadataStore:
+    """Per-run store of Web API metadata.
+
+    Track objects are filled in batches by collection downloads, album, episode and playlist
+    lookups are memoized through `get`, which also makes concurrent lookups of one id share
+    a single request.
+    """
+    _tracks: dict[str, dict] = {}
+    _artists: dict[str, dict] | None = None
+    _objects: dict[tuple[str, str], Future] = {}
+    _lock = Lock()
+
+    @classmethod
+    def get(cls, kind: str, key: str, fetch):
+        """ Returns fetch() for this kind and key, calling it at most once per run unless it returned None or an error """
+        with cls._lock:
+            future = cls._objects.get((kind, key))
+            owner = future is None
+            if owner:
+                future = cls._objects[(kind, key)] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            result = fetch()
+        except BaseException as e:
+            with cls._lock:
+                cls._objects.pop((kind, key), None)
+            future.set_exception(e)
+            raise
+        if result is None or isinstance(result, dict) and ERROR in result:
+            # failures reach the callers already waiting, later lookups try again
+            with cls._lock:
+                cls._objects.pop((kind, key), None)
+        future.set_result(result)
+        return result
+
+    @classmethod
+    def prefetch_tracks(cls, track_ids: list[str]) -> None:
+        """ Fetches every missing track object with as few requests to TRACKS_URL as possible """
+        with cls._lock:
+            missing = list(dict.fromkeys(i for i in track_ids if i and i not in cls._tracks))
+
+        for i in range(0, len(missing), TRACKS_BATCH_SIZE):
+            batch = missing[i:i + TRACKS_BATCH_SIZE]
+            (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={",".join(batch)}&market=from_token')
+            if not info or TRACKS not in info:
+                # leave the batch to the per-track lookup in download_track, which reports the error
+                continue
+            with cls._lock:
+                # results come back in request order, keyed by the requested id in case of relinking
+                for track_id, track in zip(batch, info[TRACKS]):
+                    if track is not None:
+                        cls._tracks[track_id] = track
+
+        if Zotify.CONFIG.get_save_genres():
+            with cls._lock:
+                artist_ids = [artist[ID] for i in track_ids if i in cls._tracks for artist in cls._tracks[i][ARTISTS]]
+            cls.prefetch_artists(artist_ids)
+
+    @classmethod
+    def add_tracks(cls, tracks: dict[str, dict]) -> None:
+        """ Stores full track objects built from another endpoint's payload """
+        with cls._lock:
+            cls._tracks.update(tracks)
+
+    @classmethod
+    def get_track(cls, track_id: str) -> dict | None:
+        """ Returns the track object, fetching it on its own if it was not prefetched """
+        with cls._lock:
+            track = cls._tracks.get(track_id)
+        if track is None:
+            cls.get(TRACKS, track_id, lambda: cls.prefetch_tracks([track_id]))
+            with cls._lock:
+                track = cls._tracks.get(track_id)
+        return track
+
+    @classmethod
+    def prefetch_artists(cls, artist_ids: list[str]) -> None:
+        """ Fetches the genres of every artist missing from the cache through the multi-id artists endpoint """
+        with cls._lock:
+            cls._load_artists()
+            missing = list(dict.fromkeys(i for i in artist_ids if i and not cls._is_fresh(i)))
+
+        fetched = False
+        for i in range(0, len(missing), ARTISTS_BATCH_SIZE):
+            batch = missing[i:i + ARTISTS_BATCH_SIZE]
+            (raw, info) = Zotify.invoke_url(f'{ARTISTS_URL}?ids={",".join(batch)}')
+            if not info or ARTISTS not in info:
+                continue
+            now = time.time()
+            with cls._lock:
+                for artist in info[ARTISTS]:
+                    if artist is not None:
+                        cls._artists[artist[ID]] = {GENRES: artist[GENRES], FETCHED: now}
+                        fetched = True
+
+        if fetched:
+            with cls._lock:
+                cls._save_artists()
+
+    @classmethod
+    def get_artist_genres(cls, artist_ids: list[str]) -> dict[str, list[str]]:
+        """ Returns the genres of each artist, fetching the ones not cached in a single batch """
+        cls.prefetch_artists(artist_ids)
+        with cls._lock:
+            return {i: cls._artists[i][GENRES] for i in artist_ids if i in cls._artists}
+
+    @classmethod
+    def _is_fresh(cls, artist_id: str) -> bool:
+        artist = cls._artists.get(artist_id)
+        return artist is not None and time.time() - artist[FETCHED] < Zotify.CONFIG.get_artist_cache_ttl() * 3600
+
+    @classmethod
+    def _load_artists(cls) -> None:
+        if cls._artists is not None:
+            return
+        cls._artists = {}
+        cache_dir = Zotify.CONFIG.get_cache_location()
+        if cache_dir is None or not Path(cache_dir / ARTIST_CACHE_FILE).is_file():
+            return
+        try:
+            with open(cache_dir / ARTIST_CACHE_FILE, 'r', encoding='utf-8') as file:
+                cls._artists = json.load(file)
+        except (OSError, ValueError):
+            # a damaged cache is simply rebuilt
+            cls._artists = {}
+
+    @classmethod
+    def _save_artists(cls) -> None:
+        cache_dir = Zotify.CONFIG.get_cache_location()
+        if cache_dir is None:
+            return
+        temp_path = Path(cache_dir / f'{ARTIST_CACHE_FILE}.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(cls._artists, file)
+        temp_path.replace(cache_dir / ARTIST_CACHE_FILE)
@@ -0,0 +1,245 @@
+import random
+import re
+import sqlite3
+import time
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+from pathlib import Path
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+NOT_MODIFIED = 304
+TOO_MANY_REQUESTS = 429
+# statuses worth another attempt, every other 4xx fails straight away
+RETRYABLE_STATUSES = {408, TOO_MANY_REQUESTS, 500, 502, 503, 504}
+# a transient failure is always worth a few attempts whatever RETRY_ATTEMPTS says, RetryPolicy.deadline still applies
+MIN_RETRY_ATTEMPTS = 3
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """ Returns the delay requested by a Retry-After header in seconds """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Adaptive (AIMD) pacing of requests shared by every worker.
+
+    Each successful request raises the allowed rate by a fixed step, each throttled one halves it
+    and a Retry-After delay holds back every caller until it has passed.
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, step: float):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.step = step
+        self._next = 0.0
+        self._lock = Lock()
+
+    def acquire(self) -> None:
+        """ Blocks until the caller may send its request """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + 1 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def success(self) -> None:
+        with self._lock:
+            self.rate = min(self.rate + self.step, self.max_rate)
+
+    def throttled(self, retry_after: float | None = None) -> None:
+        with self._lock:
+            self.rate = max(self.rate / 2, self.min_rate)
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self._next = max(self._next, time.monotonic() + pause)
+
+    def reset(self, rate: float, min_rate: float, max_rate: float, step: float) -> None:
+        with self._lock:
+            self.rate, self.min_rate, self.max_rate, self.step = rate, min_rate, max_rate, step
+
+
+class RetryPolicy:
+    """Decides whether and when a failed API request is tried again.
+
+    Delays grow exponentially with full jitter and are capped so no request keeps retrying
+    past `deadline` seconds. After `breaker_threshold` consecutive retryable failures across
+    all callers the circuit opens and every request pauses for `breaker_cooldown` seconds,
+    so a burst of server errors is waited out once instead of hammered by every worker.
+    """
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 30.0, deadline: float = 120.0,
+                 breaker_threshold: int = 5, breaker_cooldown: float = 30.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = Lock()
+
+    @staticmethod
+    def is_retryable(status: int | None) -> bool:
+        """ None stands for a connection error or an unreadable response body """
+        return status is None or status in RETRYABLE_STATUSES
+
+    def delay(self, attempt: int) -> float:
+        """ Returns the pause before retry number `attempt`, counting from 0 """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def wait_for_circuit(self) -> None:
+        """ Blocks while the circuit is open """
+        with self._lock:
+            pause = self._open_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+
+    def failure(self) -> bool:
+        """ Records a retryable failure, returns True if it opened the circuit """
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.breaker_threshold:
+                return False
+            self._failures = 0
+            self._open_until = time.monotonic() + self.breaker_cooldown
+            return True
+
+
+DAY = 24 * 3600
+# seconds a cached response is used without asking the API, first matching pattern wins,
+# URLs matching none of them (e.g. snapshot ids, the user's library) are never cached
+RESPONSE_CACHE_TTLS = [
+    (re.compile(r'/v1/playlists/[^/?]+\?fields=snapshot_id'), None),
+    (re.compile(r'/v1/playlists/[^/?]+\?'), DAY),
+    (re.compile(r'/v1/(albums|artists|tracks|episodes)[/?]'), 30 * DAY),
+    (re.compile(r'/color-lyrics/'), 30 * DAY),
+]
+
+
+class ResponseCache:
+    """On-disk cache of Web API responses in a SQLite database.
+
+    Entries are keyed by URL and language. Fresh entries are returned without a request, stale
+    ones are revalidated with If-None-Match when the API sent an ETag. The least recently used
+    entries are evicted once the stored bodies exceed `max_bytes`.
+    """
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body TEXT NOT NULL, '
+                             'etag TEXT, expires REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    @staticmethod
+    def ttl(url: str) -> float | None:
+        """ Returns how many seconds a response of this URL stays fresh, None if it must not be cached """
+        for pattern, ttl in RESPONSE_CACHE_TTLS:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    @staticmethod
+    def key(url: str, language: str) -> str:
+        return f'{language} {url}'
+
+    def get(self, key: str) -> tuple[str, str | None, bool] | None:
+        """ Returns the cached body, its ETag and whether it is still fresh """
+        with self._lock:
+            row = self._db.execute('SELECT body, etag, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            with self._db:
+                self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        return row[0], row[1], row[2] > now
+
+    def refresh(self, key: str, ttl: float) -> None:
+        """ Marks an entry the API confirmed as unchanged as fresh again """
+        with self._lock, self._db:
+            self._db.execute('UPDATE responses SET expires = ? WHERE key = ?', (time.time() + ttl, key))
+
+    def put(self, key: str, body: str, etag: str | None, ttl: float) -> None:
+        size = len(body.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, body, etag, now + ttl, now, size))
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(total - self.max_bytes)
+
+    def _evict(self, excess: int) -> None:
+        freed = 0
+        evicted = []
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if freed >= excess:
+                break
+            evicted.append((key,))
+            freed += size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+
+class HttpClient:
+    """Shared keep-alive HTTP session used for every Web API, lyrics, cover art and podcast request.
+
+    The underlying urllib3 connection pools are thread-safe, and cookies are never stored so
+    the session holds no other state that concurrent workers could race on.
+    """
+    _session: requests.Session | None = None
+    _pool_maxsize = POOL_MAXSIZE
+    _lock = Lock()
+    # generous enough to never slow a healthy run, mostly here to honour 429 responses
+    LIMITER = RateLimiter(rate=20.0, min_rate=0.2, max_rate=50.0, step=0.5)
+
+    @classmethod
+    def configure(cls, pool_maxsize: int) -> None:
+        """ Sizes the per-host connection pool, must be called before the first request """
+        cls._pool_maxsize = max(pool_maxsize, POOL_MAXSIZE)
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    session = requests.Session()
+                    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=cls._pool_maxsize)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    cls._session = session
+        return cls._session
+
+    @classmethod
+    def get(cls, url: str, **kwargs) -> requests.Response:
+        cls.LIMITER.acquire()
+        response = cls.session().get(url, **kwargs)
+        if response.status_code == TOO_MANY_REQUESTS:
+            cls.LIMITER.throttled(parse_retry_after(response.headers.get('Retry-After')))
+        else:
+            cls.LIMITER.success()
+        return response
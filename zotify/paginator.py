@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from zotify.const import ITEMS, TOTAL
+from zotify.zotify import Zotify
+
+
+PAGE_WORKERS = 4
+
+
+class Paginator:
+    """Iterates over the items of an offset-paginated Web API endpoint.
+
+    The first page tells `total`, the remaining pages are then requested concurrently and
+    handed out in order as soon as each one is in, so work can start on the first items
+    while later pages are still arriving.
+
+    songs = Paginator(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=100)
+    p_bar = Printer.progress(total=songs.total)
+    for song in songs:
+        ...
+
+    With `workers=1` each page is only requested once the previous one has been consumed,
+    for callers that usually stop early.
+    """
+
+    def __init__(self, url: str, limit: int = 50, first_page: dict | None = None, workers: int = PAGE_WORKERS, **params):
+        self.url = url
+        self.limit = limit
+        self.workers = workers
+        self.params = params
+        self._first_page = first_page
+
+    def _fetch(self, offset: int) -> list:
+        return Zotify.invoke_url_with_params(self.url, limit=self.limit, offset=offset, **self.params)[ITEMS]
+
+    def _get_first_page(self) -> dict:
+        if self._first_page is None:
+            self._first_page = Zotify.invoke_url_with_params(self.url, limit=self.limit, offset=0, **self.params)
+        return self._first_page
+
+    @property
+    def total(self) -> int:
+        """ Number of items the endpoint reported on its first page """
+        return self._get_first_page()[TOTAL]
+
+    def pages(self):
+        """ Yields each page's list of items in order """
+        first_page = self._get_first_page()
+        yield first_page[ITEMS]
+        offsets = range(len(first_page[ITEMS]), first_page[TOTAL], self.limit)
+        if not first_page[ITEMS] or not offsets:
+            return
+
+        if self.workers <= 1:
+            for offset in offsets:
+                items = self._fetch(offset)
+                yield items
+                if len(items) < self.limit:
+                    break
+            return
+
+        executor = ThreadPoolExecutor(max_workers=min(self.workers, len(offsets)), thread_name_prefix='zotify-pages')
+        try:
+            futures = [executor.submit(self._fetch, offset) for offset in offsets]
+            for future in futures:
+                items = future.result()
+                yield items
+                # the library shrank since the first page was read
+                if len(items) < self.limit:
+                    break
+        finally:
+            # callers may stop early, pages not yet requested are dropped
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __iter__(self):
+        for items in self.pages():
+            yield from items
@@ -1,7 +1,11 @@
-from zotify.const import ITEMS, ID, TRACK, NAME, TYPE
+from zotify.const import ID, TRACK, NAME, TYPE, SNAPSHOT_ID, PLAYLIST
+from zotify.metadata import MetadataStore
+from zotify.paginator import Paginator
 from zotify.podcast import download_episode
-from zotify.termoutput import Printer
-from zotify.track import download_track
+from zotify.scheduler import DownloadPool, PostProcessor, StreamPrefetcher
+from zotify.sync import SyncState, PLAYLISTS, ITEM_IDS
+from zotify.termoutput import Printer, PrintChannel
+from zotify.track import download_track, will_download
 from zotify.utils import split_input, strptime_utc
 from zotify.zotify import Zotify
 
@@ -11,32 +15,12 @@ PLAYLISTS_URL = 'https://api.spot'+'ify.com/v1/playlists'
 
 def get_all_playlists():
     """ Returns list of users playlists """
-    playlists = []
-    limit = 50
-    offset = 0
-
-    while True:
-        resp = Zotify.invoke_url_with_params(MY_PLAYLISTS_URL, limit=limit, offset=offset)
-        offset += limit
-        playlists.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return playlists
+    return list(Paginator(MY_PLAYLISTS_URL, limit=50))
 
 
 def get_playlist_songs(playlist_id):
     """ returns list of songs in a playlist """
-    songs = []
-    offset = 0
-    limit = 100
-    
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
+    songs = list(Paginator(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=100))
     
     # filtering by added date inverts playlist order, ruining the .m3u8 file, so skip if exporting m3u8
     if not Zotify.CONFIG.get_export_m3u8(): 
@@ -47,38 +31,80 @@ def get_playlist_songs(playlist_id):
 
 def get_playlist_info(playlist_id) -> tuple[str, str]:
     """ Returns information scraped from playlist """
-    (raw, resp) = Zotify.invoke_url(f'{PLAYLISTS_URL}/{playlist_id}?fields=name,owner(display_name)&market=from_token')
+    resp = MetadataStore.get(PLAYLIST, playlist_id, lambda: Zotify.invoke_url(
+        f'{PLAYLISTS_URL}/{playlist_id}?fields=name,owner(display_name)&market=from_token')[1])
     return resp['name'].strip(), resp['owner']['display_name'].strip()
 
 
+def get_playlist_snapshot_id(playlist_id) -> str | None:
+    """ Returns the id of the playlist's current version """
+    (raw, resp) = Zotify.invoke_url(f'{PLAYLISTS_URL}/{playlist_id}?fields=snapshot_id')
+    return resp.get(SNAPSHOT_ID)
+
+
 def download_playlist(playlist, wrapper_p_bars: list | None = None):
     """Downloads all the songs from a playlist"""
+    synced = None
+    if Zotify.CONFIG.get_sync_playlists():
+        # playlists listed by get_all_playlists already carry their snapshot id
+        snapshot_id = playlist.get(SNAPSHOT_ID) or get_playlist_snapshot_id(playlist[ID])
+        synced = SyncState.get(PLAYLISTS, playlist[ID])
+        if synced is not None and snapshot_id and synced[SNAPSHOT_ID] == snapshot_id:
+            Printer.print(PrintChannel.SKIPS, f'###   SKIPPING: "{playlist[NAME]}" (PLAYLIST UNCHANGED SINCE LAST SYNC)   ###')
+            Printer.print(PrintChannel.SKIPS, "\n\n")
+            return
+    
     playlist_songs = [song_dict[TRACK] for song_dict in get_playlist_songs(playlist[ID]) if song_dict[TRACK] is not None and song_dict[TRACK][ID]]
     char_num = max({len(str(len(playlist_songs))), 2})
     
+    numbered_songs = list(enumerate(playlist_songs, start=1))
+    if synced is not None:
+        # only songs added since the last sync are processed, numbered by their place in the whole playlist
+        known_ids = set(synced[ITEM_IDS])
+        numbered_songs = [(n, song) for n, song in numbered_songs if song[ID] not in known_ids]
+    
     pos = 3
     if wrapper_p_bars is not None:
         pos = wrapper_p_bars[-1] if type(wrapper_p_bars[-1]) is int else -(wrapper_p_bars[-1].pos + 2)
     else:
         wrapper_p_bars = []
-    p_bar = Printer.progress(enumerate(playlist_songs, start=1), unit='songs', total=len(playlist_songs), unit_scale=True,
+    p_bar = Printer.progress(unit='songs', total=len(numbered_songs), unit_scale=True,
                              disable=not Zotify.CONFIG.get_show_playlist_pbar(), pos=pos)
     wrapper_p_bars.append(p_bar if Zotify.CONFIG.get_show_playlist_pbar() else pos)
     
-    for n, song in p_bar:
-        if song[TYPE] == "episode": # Playlist item is a podcast episode
-            download_episode(song[ID])
-        else:
-            download_track('extplaylist', song[ID], extra_keys=
-                           {'playlist_song_name': song[NAME],
-                            'playlist': playlist[NAME],
-                            'playlist_num': str(n).zfill(char_num),
-                            'playlist_id': playlist[ID],
-                            'playlist_track_id': song[ID]},
-                           wrapper_p_bars=wrapper_p_bars)
-        p_bar.set_description(song[NAME])
-        for bar in wrapper_p_bars:
-            if type(bar) != int: bar.refresh()
+    MetadataStore.prefetch_tracks([song[ID] for n, song in numbered_songs if song[TYPE] != "episode"])
+    
+    song_keys = [(song, {'playlist_song_name': song[NAME],
+                         'playlist': playlist[NAME],
+                         'playlist_num': str(n).zfill(char_num),
+                         'playlist_id': playlist[ID],
+                         'playlist_track_id': song[ID]})
+                 for n, song in numbered_songs]
+    # a song listed twice is prefetched for its first entry
+    track_keys = {}
+    for song, extra_keys in song_keys:
+        if song[TYPE] != "episode":
+            track_keys.setdefault(song[ID], extra_keys)
+    
+    with StreamPrefetcher(list(track_keys), lambda track_id: will_download('extplaylist', track_id, track_keys[track_id])), \
+            DownloadPool(p_bar, wrapper_p_bars) as pool:
+        for song, extra_keys in song_keys:
+            if song[TYPE] == "episode": # Playlist item is a podcast episode
+                pool.submit(song[NAME], download_episode, song[ID])
+            else:
+                pool.submit(song[NAME], download_track, 'extplaylist', song[ID], extra_keys=dict(extra_keys),
+                            wrapper_p_bars=wrapper_p_bars)
+    
+    if Zotify.CONFIG.get_sync_playlists():
+        # failed songs are left out, to be retried once the playlist changes
+        PostProcessor.wait()
+        failed = SyncState.failed()
+        item_ids = [song[ID] for song in playlist_songs if song[ID] not in failed]
+        SyncState.set(PLAYLISTS, playlist[ID], {
+            # without a snapshot the next sync always looks at the playlist, and retries what failed
+            SNAPSHOT_ID: snapshot_id if len(item_ids) == len(playlist_songs) else None,
+            ITEM_IDS: item_ids
+        })
 
 
 def download_from_user_playlist():
@@ -1,10 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import PurePath, Path
+from threading import Lock
+import json
 import time
 
+import requests
+
 from librespot.metadata import EpisodeId
 
-from zotify.const import ERROR, ID, ITEMS, NAME, SHOW, DURATION_MS
+from zotify.const import ERROR, ID, NAME, SHOW, DURATION_MS, EPISODE
+from zotify.metadata import MetadataStore
+from zotify.network import HttpClient, MIN_RETRY_ATTEMPTS
+from zotify.paginator import Paginator
+from zotify.scheduler import DownloadPool
+from zotify.stream import StreamCopier
 from zotify.termoutput import PrintChannel, Printer
+from zotify.track import reopen_stream
 from zotify.utils import create_download_directory, fix_filename, wait_between_downloads
 from zotify.zotify import Zotify
 from zotify.loader import Loader
@@ -14,11 +25,14 @@ EPISODE_INFO_URL = 'https://api.spot'+'ify.com/v1/episodes'
 SHOWS_URL = 'https://api.spot'+'ify.com/v1/shows'
 PARTNER_URL = 'https://api-partner.spot'+'ify.com/pathfinder/v1/query?operationName=getEpisode&variables={"uri":"spotify:episode:'
 PERSISTED_QUERY = '{"persistedQuery":{"version":1,"sha256Hash":"224ba0fd89fcfdfb3a15fa2d82a6112d3f4e2ac88fba5c6713de04d1b72cf482"}}'
+PARTIAL_CONTENT = 206
+PODCAST_CHUNK_SIZE = 256 * 1024
+PODCAST_SAVE_INTERVAL = 1024 * 1024
 
 
 def get_episode_info(episode_id_str) -> tuple[str | None, str | None, str | None]:
     with Loader(PrintChannel.PROGRESS_INFO, "Fetching episode information..."):
-        (raw, info) = Zotify.invoke_url(f'{EPISODE_INFO_URL}/{episode_id_str}')
+        info = MetadataStore.get(EPISODE, episode_id_str, lambda: Zotify.invoke_url(f'{EPISODE_INFO_URL}/{episode_id_str}')[1])
     if not info:
         Printer.print(PrintChannel.ERRORS, "###   INVALID EPISODE ID   ###")
     if ERROR in info:
@@ -28,46 +42,128 @@ def get_episode_info(episode_id_str) -> tuple[str | None, str | None, str | None
 
 
 def get_show_episodes(show_id_str) -> list:
-    episodes = []
-    offset = 0
-    limit = 50
-
     with Loader(PrintChannel.PROGRESS_INFO, "Fetching episodes..."):
-        while True:
-            resp = Zotify.invoke_url_with_params(
-                f'{SHOWS_URL}/{show_id_str}/episodes', limit=limit, offset=offset)
-            offset += limit
-            for episode in resp[ITEMS]:
-                episodes.append(episode[ID])
-            if len(resp[ITEMS]) < limit:
-                break
+        return [episode[ID] for episode in Paginator(f'{SHOWS_URL}/{show_id_str}/episodes', limit=50)]
+
+
+def get_content_range_total(value: str | None) -> int | None:
+    """ Returns the full size from a `bytes start-end/total` Content-Range header """
+    if not value or '/' not in value:
+        return None
+    total = value.rsplit('/', 1)[1]
+    return int(total) if total.isdigit() else None
+
+
+def load_segments(state_path: Path, file_size: int, etag: str | None) -> list[list[int]] | None:
+    """ Returns the [start, end, written] segments of an earlier partial download of the same file """
+    try:
+        with open(state_path, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+        if state['size'] != file_size or state['etag'] != etag:
+            return None
+        return state['segments']
+    except (OSError, ValueError, KeyError):
+        return None
 
-    return episodes
+
+def plan_segments(file_size: int, count: int) -> list[list[int]]:
+    """ Splits the file into count byte ranges, each as [start, end, written] with an inclusive end """
+    step = -(-file_size // count)
+    return [[start, min(start + step, file_size) - 1, 0] for start in range(0, file_size, step)]
 
 
 def download_podcast_directly(url, filename):
-    import functools
-    import shutil
-    import requests
     from tqdm.auto import tqdm
     
-    r = requests.get(url, stream=True, allow_redirects=True)
-    if r.status_code != 200:
+    path = Path(filename).expanduser().resolve()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = path.with_name(path.name + '.part')
+    state_path = path.with_name(path.name + '.part.json')
+    
+    # an open ended range tells whether the server can resume and how large the file is
+    r = HttpClient.get(url, stream=True, allow_redirects=True, headers={'Range': 'bytes=0-', 'Accept-Encoding': 'identity'})
+    if r.status_code not in (200, PARTIAL_CONTENT):
         r.raise_for_status()  # Will only raise for 4xx codes, so...
         raise RuntimeError(
             f"Request to {url} returned status code {r.status_code}")
-    file_size = int(r.headers.get('Content-Length', 0))
     
-    path = Path(filename).expanduser().resolve()
-    path.parent.mkdir(parents=True, exist_ok=True)
+    file_size = get_content_range_total(r.headers.get('Content-Range')) if r.status_code == PARTIAL_CONTENT else None
+    if not file_size:
+        # the server ignores ranges, the file can only be streamed from the start
+        file_size = int(r.headers.get('Content-Length', 0))
+        desc = "(Unknown total file size)" if file_size == 0 else ""
+        with tqdm(total=file_size, desc=desc, unit='B', unit_scale=True, unit_divisor=1024) as p_bar, \
+                part_path.open("wb") as f:
+            for chunk in r.iter_content(chunk_size=PODCAST_CHUNK_SIZE):
+                p_bar.update(f.write(chunk))
+        part_path.replace(path)
+        return path
+    
+    etag = r.headers.get('ETag')
+    r.close()
+    
+    segments = load_segments(state_path, file_size, etag) if part_path.is_file() else None
+    if segments is None:
+        segments = plan_segments(file_size, max(Zotify.CONFIG.get_podcast_segments(), 1))
+        with part_path.open("wb") as f:
+            f.truncate(file_size)
+    
+    lock = Lock()
+    
+    def save_state() -> None:
+        temp_path = state_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'size': file_size, 'etag': etag, 'segments': segments}, file)
+        temp_path.replace(state_path)
     
-    desc = "(Unknown total file size)" if file_size == 0 else ""
-    r.raw.read = functools.partial(
-        r.raw.read, decode_content=True)  # Decompress if needed
-    with tqdm.wrapattr(r.raw, "read", total=file_size, desc=desc) as r_raw:
-        with path.open("wb") as f:
-            shutil.copyfileobj(r_raw, f)
+    def fetch_segment(segment: list[int], p_bar) -> None:
+        start, end = segment[0], segment[1]
+        attempt = 0
+        while start + segment[2] <= end:
+            try:
+                resp = HttpClient.get(url, stream=True, allow_redirects=True,
+                                      headers={'Range': f'bytes={start + segment[2]}-{end}', 'Accept-Encoding': 'identity'})
+                if resp.status_code != PARTIAL_CONTENT:
+                    raise RuntimeError(f"Request to {url} returned status code {resp.status_code} for a range")
+                with part_path.open("r+b") as f:
+                    f.seek(start + segment[2])
+                    saved = segment[2]
+                    for chunk in resp.iter_content(chunk_size=PODCAST_CHUNK_SIZE):
+                        chunk = chunk[:end + 1 - start - segment[2]]
+                        f.write(chunk)
+                        p_bar.update(len(chunk))
+                        with lock:
+                            segment[2] += len(chunk)
+                            if segment[2] - saved >= PODCAST_SAVE_INTERVAL:
+                                f.flush()
+                                save_state()
+                                saved = segment[2]
+                        if start + segment[2] > end:
+                            break
+                    f.flush()
+                    with lock:
+                        save_state()
+                if start + segment[2] <= end:
+                    raise RuntimeError(f"Connection to {url} closed before the end of the range")
+            except (requests.RequestException, RuntimeError):
+                # a dropped connection continues where it stopped instead of restarting the episode
+                if attempt >= max(Zotify.CONFIG.get_retry_attempts(), MIN_RETRY_ATTEMPTS) - 1:
+                    raise
+                time.sleep(Zotify.RETRY_POLICY.delay(attempt))
+                attempt += 1
+    
+    with tqdm(total=file_size, initial=sum(s[2] for s in segments), unit='B', unit_scale=True, unit_divisor=1024) as p_bar:
+        pending = [s for s in segments if s[0] + s[2] <= s[1]]
+        if len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix='zotify-segments') as executor:
+                for future in [executor.submit(fetch_segment, segment, p_bar) for segment in pending]:
+                    future.result()
+        else:
+            for segment in pending:
+                fetch_segment(segment, p_bar)
     
+    part_path.replace(path)
+    state_path.unlink(missing_ok=True)
     return path
 
 
@@ -120,7 +216,9 @@ def download_episode(episode_id, wrapper_p_bars: list | None = None) -> None:
                 Printer.print(PrintChannel.ERRORS, f'###   SKIPPING EPISODE - FAILED TO GET CONTENT STREAM - Episode_ID: {str(episode_id)}   ###')
                 Printer.print(PrintChannel.SKIPS, "\n\n")
             else:
-                total_size = stream.input_stream.size
+                source = stream.input_stream.stream()
+                # librespot has already skipped the file header, only the rest of the file is delivered
+                total_size = stream.input_stream.size - source.pos()
 
                 filepath = PurePath(download_directory).joinpath(f"{filename}.ogg")
                 if (Path(filepath).is_file()
@@ -133,13 +231,12 @@ def download_episode(episode_id, wrapper_p_bars: list | None = None) -> None:
                     return
 
                 prepare_download_loader.stop()
-                time_start = time.time()
-                downloaded = 0
                 pos = 1
                 if wrapper_p_bars is not None:
                     pos = wrapper_p_bars[-1] if type(wrapper_p_bars[-1]) is int else -(wrapper_p_bars[-1].pos + 2)
                     for bar in wrapper_p_bars:
                         if type(bar) != int: bar.refresh()
+                pos = DownloadPool.bar_position(pos, wrapper_p_bars)
                 with open(filepath, 'wb') as file, Printer.progress(
                     desc=filename,
                     total=total_size,
@@ -150,24 +247,21 @@ def download_episode(episode_id, wrapper_p_bars: list | None = None) -> None:
                     pos=pos
                 ) as p_bar:
                     prepare_download_loader.stop()
-                    while True:
-                    #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
-                        data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
-                        p_bar.update(file.write(data))
-                        downloaded += len(data)
-                        if data == b'':
-                            break
-                        if Zotify.CONFIG.get_download_real_time():
-                            delta_real = time.time() - time_start
-                            delta_want = (downloaded / total_size) * (int(duration_ms)/1000)
-                            if delta_want > delta_real:
-                                time.sleep(delta_want - delta_real)
-                                
+                    copier = StreamCopier(source, file, Zotify.CONFIG.get_chunk_size())
+                    copier.copy_resuming(lambda offset: reopen_stream(episode_id, offset, filename),
+                                         Zotify.CONFIG.get_retry_attempts(), p_bar, total_size,
+                                         duration=int(duration_ms) / 1000 if Zotify.CONFIG.get_download_real_time() else None)
                 
                 wait_between_downloads()
         else:
             filepath = PurePath(download_directory).joinpath(f"{filename}.mp3")
-            download_podcast_directly(direct_download_url, filepath)
+            try:
+                download_podcast_directly(direct_download_url, filepath)
+            except (requests.RequestException, RuntimeError) as e:
+                # the .part file and its ranges are kept, the next run continues from there
+                prepare_download_loader.stop()
+                Printer.print(PrintChannel.ERRORS, f'###   SKIPPING EPISODE - DOWNLOAD FAILED - Episode_ID: {str(episode_id)}   ###')
+                Printer.print(PrintChannel.ERRORS, f'{e}\n\n')
             
             wait_between_downloads()
     
@@ -0,0 +1,349 @@
+import atexit
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import count
+from threading import BoundedSemaphore, Condition, Lock, local
+
+from librespot.metadata import TrackId
+
+from zotify.config import Config, PRINT_PROGRESS_INFO
+from zotify.const import ID, IS_PLAYABLE
+from zotify.metadata import MetadataStore
+from zotify.zotify import Zotify
+
+
+_worker = local()
+
+
+class OrderedGate:
+    """ Lets jobs enter a section strictly in the order they were submitted """
+
+    def __init__(self):
+        self._cond = Condition()
+        self._next = 0
+        self._done = set()
+
+    def wait(self, ticket: int) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self._next >= ticket)
+
+    def release(self, ticket: int) -> None:
+        with self._cond:
+            self._done.add(ticket)
+            while self._next in self._done:
+                self._done.remove(self._next)
+                self._next += 1
+            self._cond.notify_all()
+
+
+class DownloadPool:
+    """Runs the downloads of a collection on a bounded pool of worker threads.
+
+    Jobs are submitted in collection order, so any numbering computed by the caller
+    (`{album_num}`, `{playlist_num}`) is unaffected. Code that must run in collection
+    order regardless of which job finishes first (e.g. m3u8 export) is wrapped in
+    `DownloadPool.in_order()`.
+
+    with DownloadPool(p_bar, wrapper_p_bars) as pool:
+        for track in tracks:
+            pool.submit(track[NAME], download_track, 'album', track[ID])
+    """
+
+    def __init__(self, p_bar=None, wrapper_p_bars: list | None = None):
+        self.p_bar = p_bar
+        self.wrapper_p_bars = wrapper_p_bars if wrapper_p_bars is not None else []
+        self.workers = max(Zotify.CONFIG.get_download_workers(), 1)
+        # nested collections (e.g. DOWNLOAD_PARENT_ALBUM) run inline on the calling worker
+        self._nested = getattr(_worker, 'slot', None) is not None
+        if self._nested:
+            self.workers = 1
+        self._executor = None
+        self._slots = count()
+        self._slots_lock = Lock()
+        self._gate = OrderedGate()
+        self._tickets = 0
+        self._futures = []
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='zotify-worker',
+                                                initializer=self._init_worker)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._executor is None:
+            return
+        if exc_type is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            return
+        try:
+            for future in self._futures:
+                future.result()
+        except BaseException:
+            # Ctrl-C or a failed job stops the collection, queued tracks are not started
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        self._executor.shutdown(wait=True)
+
+    def _init_worker(self) -> None:
+        with self._slots_lock:
+            _worker.slot = next(self._slots)
+
+    def submit(self, desc: str, func, *args, **kwargs) -> None:
+        """ Schedules func(*args, **kwargs), running it immediately when only one worker is configured """
+        if self._executor is None:
+            nested = getattr(_worker, 'nested', False)
+            # bars of a nested collection sit under the bar of the job that started it, already offset
+            _worker.nested = nested or self._nested
+            try:
+                func(*args, **kwargs)
+            finally:
+                _worker.nested = nested
+            self._job_done(desc)
+            return
+
+        ticket = self._tickets
+        self._tickets += 1
+        self._futures.append(self._executor.submit(self._run, ticket, desc, func, *args, **kwargs))
+
+    def _run(self, ticket: int, desc: str, func, *args, **kwargs) -> None:
+        _worker.gate, _worker.ticket = self._gate, ticket
+        try:
+            func(*args, **kwargs)
+        finally:
+            self._gate.release(ticket)
+            _worker.gate = _worker.ticket = None
+            self._job_done(desc)
+
+    def _job_done(self, desc: str) -> None:
+        if self.p_bar is None:
+            return
+        self.p_bar.update(1)
+        self.p_bar.set_description(desc)
+        for bar in self.wrapper_p_bars:
+            if type(bar) != int: bar.refresh()
+
+    @staticmethod
+    @contextmanager
+    def in_order():
+        """ Blocks until every earlier job of the current collection has passed this section """
+        gate = getattr(_worker, 'gate', None)
+        if gate is None:
+            yield
+            return
+        ticket = _worker.ticket
+        gate.wait(ticket)
+        try:
+            yield
+        finally:
+            gate.release(ticket)
+
+    @staticmethod
+    def worker_slot() -> int:
+        """ Returns the index of the worker running the current job, 0 outside of a pool """
+        return getattr(_worker, 'slot', None) or 0
+
+    @staticmethod
+    def bar_position(pos: int, wrapper_p_bars: list | None, rows: int = 1) -> int:
+        """Moves the progress bar of every worker but the first below the collection bars.
+
+        `rows` is the number of bars a job stacks, e.g. 2 for an album bar with its track bar.
+        """
+        slot = DownloadPool.worker_slot()
+        if not slot or getattr(_worker, 'nested', False):
+            return pos
+        outer = max([bar if type(bar) is int else -bar.pos for bar in wrapper_p_bars or []] + [pos])
+        return outer + 2 * rows * slot
+
+
+class StreamPrefetcher:
+    """Opens the audio streams of the next STREAM_PREFETCH tracks of a collection in the background.
+
+    download_track takes a track's stream with `StreamPrefetcher.take` when its turn comes, which
+    also schedules the tracks after it. `wanted(track_id)` runs download_track's skip checks first,
+    so no audio key is spent on a track that is already downloaded. Streams that are not taken after
+    all are closed once the collection has moved STREAM_PREFETCH tracks past them.
+
+    # entered first, so it is still active while the pool waits for its downloads
+    with StreamPrefetcher(track_ids, lambda i: will_download('album', i)), DownloadPool(p_bar, wrapper_p_bars) as pool:
+        for track_id in track_ids:
+            pool.submit(track_id, download_track, 'album', track_id)
+    """
+    _active: list['StreamPrefetcher'] = []
+    _active_lock = Lock()
+
+    def __init__(self, track_ids: list[str] | None = None, wanted=None):
+        self.ahead = max(Zotify.CONFIG.get_stream_prefetch(), 0)
+        self.wanted = wanted
+        self._ids = []
+        self._index = {}
+        self._next = 0
+        self._futures: dict[str, Future] = {}
+        self._lock = Lock()
+        self._executor = None
+        self.extend(track_ids or [])
+
+    def __enter__(self):
+        if self.ahead > 0:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='zotify-prefetch')
+            with self._active_lock:
+                self._active.append(self)
+            with self._lock:
+                self._schedule(self.ahead - 1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._executor is None:
+            return
+        with self._active_lock:
+            self._active.remove(self)
+        with self._lock:
+            for future in self._futures.values():
+                self._drop(future)
+            self._futures.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def extend(self, track_ids: list[str]) -> None:
+        """ Appends tracks to the collection, e.g. while later pages are still being fetched """
+        with self._lock:
+            for track_id in track_ids:
+                self._index.setdefault(track_id, len(self._ids))
+                self._ids.append(track_id)
+            if self._executor is not None and not self._futures and self._next < len(self._ids):
+                self._schedule(self._next + self.ahead - 1)
+
+    def _schedule(self, last: int) -> None:
+        while self._next <= min(last, len(self._ids) - 1):
+            track_id = self._ids[self._next]
+            if track_id not in self._futures:
+                self._futures[track_id] = self._executor.submit(self._open, track_id)
+            self._next += 1
+
+    @staticmethod
+    def _drop(future: Future) -> None:
+        """ Closes a stream that will not be taken, once it is open if it is still opening """
+        if not future.cancel():
+            future.add_done_callback(StreamPrefetcher._close)
+
+    @staticmethod
+    def _close(future: Future) -> None:
+        if future.exception() is None and future.result() is not None:
+            future.result().input_stream.stream().close()
+
+    def _open(self, track_id: str):
+        # every stream costs an audio key request, do not spend one on a track that will be skipped
+        if self.wanted is not None and not self.wanted(track_id):
+            return None
+        track = MetadataStore.get_track(track_id)
+        if track is None or not track[IS_PLAYABLE]:
+            return None
+        # relinked tracks are streamed under the id download_track will use
+        return Zotify.get_content_stream(TrackId.from_base62(track[ID]), Zotify.DOWNLOAD_QUALITY)
+
+    def _take(self, track_id: str):
+        with self._lock:
+            index = self._index.get(track_id)
+            if index is None:
+                return False, None
+            future = self._futures.pop(track_id, None)
+            for stale in [i for i in self._futures if self._index[i] < index - self.ahead]:
+                self._drop(self._futures.pop(stale))
+            # tracks up to this one are already past the point where prefetching helps
+            self._next = max(self._next, index + 1)
+            self._schedule(index + self.ahead)
+        if future is None:
+            return True, None
+        try:
+            return True, future.result()
+        except Exception:
+            # download_track opens the stream itself and reports the failure
+            return True, None
+
+    @classmethod
+    def take(cls, track_id: str):
+        """ Returns the prefetched stream of a track, None if there is none """
+        with cls._active_lock:
+            active = list(cls._active)
+        for prefetcher in reversed(active):
+            found, stream = prefetcher._take(track_id)
+            if found:
+                return stream
+        return None
+
+
+def _init_postprocess_worker(values: dict) -> None:
+    values = dict(values)
+    # loader animations from several processes would garble the terminal
+    values[PRINT_PROGRESS_INFO] = False
+    Config.Values = values
+
+
+class PostProcessor:
+    """Runs the CPU-bound stage of a download (transcoding and tagging) off the download thread.
+
+    With TRANSCODE_WORKERS set to 0 jobs run inline, otherwise they are handed to a process
+    pool so the calling worker can go on to stream the next track. The callback always runs
+    in the parent process and receives the job's finished Future.
+    """
+    _executor: ProcessPoolExecutor | None = None
+    _slots: BoundedSemaphore | None = None
+    _pending = 0
+    _cond = Condition()
+
+    @classmethod
+    def submit(cls, func, callback, *args) -> None:
+        workers = Zotify.CONFIG.get_transcode_workers()
+        if workers <= 0:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            callback(future)
+            return
+
+        with cls._cond:
+            if cls._executor is None:
+                # forking while download threads hold locks (tqdm, stdout, caches) can deadlock the child
+                cls._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=_init_postprocess_worker,
+                                                    initargs=(Zotify.CONFIG.Values,))
+                # keep at most two queued jobs per process, each holds a raw file in the temp directory
+                cls._slots = BoundedSemaphore(2 * workers)
+                atexit.register(cls.shutdown)
+
+        cls._slots.acquire()
+        try:
+            future = cls._executor.submit(func, *args)
+        except BaseException:
+            # e.g. BrokenProcessPool, the job never started so wait() must not count it
+            cls._slots.release()
+            raise
+        with cls._cond:
+            cls._pending += 1
+        future.add_done_callback(lambda f: cls._done(f, callback))
+
+    @classmethod
+    def _done(cls, future: Future, callback) -> None:
+        try:
+            callback(future)
+        finally:
+            cls._slots.release()
+            with cls._cond:
+                cls._pending -= 1
+                cls._cond.notify_all()
+
+    @classmethod
+    def wait(cls) -> None:
+        """ Blocks until every submitted job and its callback has finished """
+        with cls._cond:
+            cls._cond.wait_for(lambda: cls._pending == 0)
+
+    @classmethod
+    def shutdown(cls) -> None:
+        if cls._executor is None:
+            return
+        cls.wait()
+        cls._executor.shutdown(wait=True)
+        cls._executor = None
@@ -0,0 +1,133 @@
+import time
+
+
+MAX_CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 0.25
+CHECKPOINT_INTERVAL = 1024 * 1024
+# a stream ending early is always worth reopening, whatever RETRY_ATTEMPTS says
+MIN_SHORT_READ_ATTEMPTS = 3
+
+
+class ShortReadError(IOError):
+    """ The stream ended before delivering the size it announced, the copy can be resumed from `downloaded` """
+
+    def __init__(self, downloaded: int, total_size: int):
+        super().__init__(f'Stream ended after {downloaded} of {total_size} bytes')
+        self.downloaded = downloaded
+        self.total_size = total_size
+
+
+def supports_readinto(source) -> bool:
+    """ Whether source.readinto fills a buffer from the same data read() returns """
+    # a readinto inherited from e.g. io.BytesIO would bypass an overridden read()
+    mro = type(source).__mro__
+    read_owner = next((c for c in mro if 'read' in c.__dict__), None)
+    readinto_owner = next((c for c in mro if 'readinto' in c.__dict__), None)
+    return read_owner is not None and readinto_owner is not None and issubclass(readinto_owner, read_owner)
+
+
+class StreamCopier:
+    """Copies an audio stream into a file, through one preallocated buffer when the source has readinto.
+
+    Reads start at `chunk_size` and double up to MAX_CHUNK_SIZE while the source keeps filling
+    them, progress bar updates are batched to one every PROGRESS_INTERVAL seconds and real-time
+    pacing is only computed once per chunk.
+
+    copier = StreamCopier(stream.input_stream.stream(), file, Zotify.CONFIG.get_chunk_size())
+    downloaded = copier.copy(p_bar, total_size)
+
+    With a known total_size the copy stops at exactly that many bytes and raises ShortReadError
+    if the stream runs dry first, so a returned copy is always complete.
+    """
+
+    def __init__(self, source, sink, chunk_size: int):
+        self.sink = sink
+        self.chunk_size = max(min(chunk_size, MAX_CHUNK_SIZE), 1)
+        self._buffer = None
+        self._set_source(source)
+
+    def _set_source(self, source) -> None:
+        self.source = source
+        self._readinto = supports_readinto(source)
+        # librespot's streams only override read(), they never need the buffer
+        if self._readinto and self._buffer is None:
+            self._buffer = memoryview(bytearray(MAX_CHUNK_SIZE))
+
+    def _read(self, size: int):
+        if self._readinto:
+            n = self.source.readinto(self._buffer[:size])
+            return self._buffer[:n or 0]
+        return self.source.read(size)
+
+    def copy(self, p_bar, total_size: int, downloaded: int = 0, max_empty_reads: int = 1,
+             duration: float | None = None, checkpoint=None) -> int:
+        """Copies the rest of the stream, returning the bytes written including `downloaded`.
+
+        Without a total_size the copy ends once max_empty_reads reads in a row came back empty.
+
+        With `duration` set the copy is paced to take as long as the audio plays, `checkpoint`
+        is called with the byte count every CHECKPOINT_INTERVAL bytes, right after a flush.
+        """
+        time_start = time.time()
+        last_update = time_start
+        start = downloaded
+        pending = 0
+        checkpointed = downloaded
+        empty_reads = 0
+        chunk_size = self.chunk_size
+
+        try:
+            while total_size <= 0 or downloaded < total_size:
+                # never ask for bytes past the end, the read would block until the stream times out
+                data = self._read(min(chunk_size, total_size - downloaded) if total_size > 0 else chunk_size)
+                size = len(data)
+                if not size:
+                    empty_reads += 1
+                    if empty_reads < max_empty_reads:
+                        continue
+                    if total_size > 0:
+                        raise ShortReadError(downloaded, total_size)
+                    break
+                empty_reads = 0
+                self.sink.write(data)
+                downloaded += size
+                pending += size
+
+                if size == chunk_size and chunk_size < MAX_CHUNK_SIZE:
+                    chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+
+                now = time.time()
+                if now - last_update >= PROGRESS_INTERVAL:
+                    p_bar.update(pending)
+                    pending = 0
+                    last_update = now
+
+                if checkpoint is not None and downloaded - checkpointed >= CHECKPOINT_INTERVAL:
+                    self.sink.flush()
+                    checkpoint(downloaded)
+                    checkpointed = downloaded
+
+                if duration is not None and total_size:
+                    delta_want = ((downloaded - start) / total_size) * duration
+                    delta_real = now - time_start
+                    if delta_want > delta_real:
+                        time.sleep(delta_want - delta_real)
+        finally:
+            p_bar.update(pending)
+        if total_size > 0 and downloaded != total_size:
+            raise ShortReadError(downloaded, total_size)
+        return downloaded
+
+    def copy_resuming(self, reopen, attempts: int, p_bar, total_size: int, downloaded: int = 0, **kwargs) -> int:
+        """ Like copy, but after a short read continues from reopen(offset), a new source positioned at offset """
+        attempts = max(attempts, MIN_SHORT_READ_ATTEMPTS)
+        attempt = 1
+        while True:
+            try:
+                return self.copy(p_bar, total_size, downloaded, **kwargs)
+            except ShortReadError as e:
+                if attempt >= attempts:
+                    raise
+                attempt += 1
+                downloaded = e.downloaded
+                self._set_source(reopen(downloaded))
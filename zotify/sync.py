@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+from threading import Lock
+
+from zotify.zotify import Zotify
+
+
+SYNC_STATE_FILE = '.sync_state'
+PLAYLISTS = 'playlists'
+LIKED_SONGS = 'liked_songs'
+ITEM_IDS = 'item_ids'
+
+
+class SyncState:
+    """ What previous runs synced, kept as JSON next to the global song archive """
+    _state: dict | None = None
+    _failed: set[str] = set()
+    _lock = Lock()
+
+    @classmethod
+    def mark_failed(cls, track_id: str) -> None:
+        """ Remembers a track that could not be downloaded in this run, so it is not recorded as synced """
+        with cls._lock:
+            cls._failed.add(track_id)
+
+    @classmethod
+    def failed(cls) -> set[str]:
+        with cls._lock:
+            return set(cls._failed)
+
+    @classmethod
+    def _path(cls) -> Path:
+        return Path(Zotify.CONFIG.get_song_archive_location()).parent / SYNC_STATE_FILE
+
+    @classmethod
+    def _load(cls) -> dict:
+        if cls._state is None:
+            cls._state = {}
+            if cls._path().is_file():
+                try:
+                    with open(cls._path(), 'r', encoding='utf-8') as file:
+                        cls._state = json.load(file)
+                except (OSError, ValueError):
+                    # losing the state only costs one full sync
+                    cls._state = {}
+        return cls._state
+
+    @classmethod
+    def get(cls, section: str, key: str) -> dict | None:
+        with cls._lock:
+            return cls._load().get(section, {}).get(key)
+
+    @classmethod
+    def set(cls, section: str, key: str, value: dict) -> None:
+        with cls._lock:
+            cls._load().setdefault(section, {})[key] = value
+            temp_path = cls._path().with_suffix('.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(cls._state, file)
+            temp_path.replace(cls._path())
@@ -1,108 +1,129 @@
+from concurrent.futures import Future
 from pathlib import Path, PurePath
+import hashlib
 import math
+import subprocess
 import time
-import uuid
-from typing import Any
 
+from librespot.audio.decoders import VorbisOnlyAudioQuality
 from librespot.metadata import TrackId
 import ffmpy
 
-from zotify.const import TRACKS, ALBUM, GENRES, NAME, ITEMS, DISC_NUMBER, TRACK_NUMBER, TOTAL_TRACKS, IS_PLAYABLE, ARTISTS, IMAGES, URL, \
-    RELEASE_DATE, ID, TRACKS_URL, FOLLOWED_ARTISTS_URL, SAVED_TRACKS_URL, TRACK_STATS_URL, CODEC_MAP, EXT_MAP, DURATION_MS, \
-    HREF, ARTISTS, WIDTH, COMPILATION, ALBUM_TYPE
+from zotify.const import ALBUM, NAME, ITEMS, TOTAL_TRACKS, ARTISTS, ID, FOLLOWED_ARTISTS_URL, SAVED_TRACKS_URL, CODEC_MAP, \
+    EXT_MAP, TRACK, ADDED_AT, NEXT
 from zotify.config import EXPORT_M3U8
+from zotify.metadata import MetadataStore, TrackMetadata
+from zotify.paginator import Paginator, PAGE_WORKERS
+from zotify.scheduler import DownloadPool, PostProcessor, StreamPrefetcher
+from zotify.stream import StreamCopier
+from zotify.sync import SyncState, LIKED_SONGS, ITEM_IDS
 from zotify.termoutput import Printer, PrintChannel
 from zotify.utils import fix_filename, set_audio_tags, set_music_thumbnail, create_download_directory, add_to_m3u8, fetch_m3u8_songs, \
-    get_directory_song_ids, add_to_directory_song_ids, get_previously_downloaded, add_to_archive, fmt_seconds, wait_between_downloads
+    get_directory_song_ids, add_to_directory_song_ids, get_previously_downloaded, add_to_archive, fmt_seconds, wait_between_downloads, \
+    strptime_utc, PartialDownload
 from zotify.zotify import Zotify
 import traceback
 from zotify.loader import Loader
 
 
-def get_saved_tracks() -> list:
-    """ Returns user's saved tracks """
+def get_saved_tracks(workers: int = PAGE_WORKERS) -> Paginator:
+    """ Returns user's saved tracks, page by page as they arrive """
+    return Paginator(SAVED_TRACKS_URL, limit=50, workers=workers)
+
+
+def get_new_saved_tracks() -> list:
+    """ Returns the tracks saved since the last liked songs sync, newest first """
+    synced = SyncState.get(LIKED_SONGS, Zotify.SESSION.username())
+    if synced is None:
+        return list(get_saved_tracks())
+    
+    mark = strptime_utc(synced[ADDED_AT])
     songs = []
-    offset = 0
-    limit = 50
-
-    while True:
-        resp = Zotify.invoke_url_with_params(
-            SAVED_TRACKS_URL, limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
+    # saved tracks come newest first, so paging stops at the first song older than the mark,
+    # usually on the first page, later pages are only requested when they are needed
+    for song in get_saved_tracks(workers=1):
+        added_at = strptime_utc(song[ADDED_AT])
+        if added_at < mark:
             break
-
+        if added_at == mark and song[TRACK][ID] in synced[ITEM_IDS]:
+            continue
+        songs.append(song)
     return songs
 
 
+def set_saved_tracks_synced(songs: list) -> None:
+    """ Moves the liked songs high-water mark to the newest of the given songs, or to the oldest that failed """
+    if not songs:
+        return
+    failed = SyncState.failed()
+    failed_songs = [song for song in songs if song[TRACK][ID] in failed]
+    if failed_songs:
+        # failed songs are left newer than the mark (or at it, but unlisted), so the next sync offers them again
+        mark = min(failed_songs, key=lambda s: strptime_utc(s[ADDED_AT]))[ADDED_AT]
+    else:
+        mark = max(songs, key=lambda s: strptime_utc(s[ADDED_AT]))[ADDED_AT]
+    item_ids = [song[TRACK][ID] for song in songs if song[ADDED_AT] == mark and song[TRACK][ID] not in failed]
+    synced = SyncState.get(LIKED_SONGS, Zotify.SESSION.username())
+    if synced is not None:
+        if strptime_utc(synced[ADDED_AT]) > strptime_utc(mark):
+            return
+        if synced[ADDED_AT] == mark:
+            # songs liked within the same second as the old mark
+            item_ids.extend(i for i in synced[ITEM_IDS] if i not in failed)
+    SyncState.set(LIKED_SONGS, Zotify.SESSION.username(), {ADDED_AT: mark, ITEM_IDS: item_ids})
+
+
 def get_followed_artists() -> list:
     """ Returns user's followed artists """
     artists = []
-    resp = Zotify.invoke_url(FOLLOWED_ARTISTS_URL)[1]
-    for artist in resp[ARTISTS][ITEMS]:
-        artists.append(artist)
+    url = f'{FOLLOWED_ARTISTS_URL}&limit=50'
+    # the endpoint is cursor based, each page links to the next through its after cursor
+    while url is not None:
+        resp = Zotify.invoke_url(url)[1]
+        if ARTISTS not in resp:
+            break
+        artists.extend(resp[ARTISTS][ITEMS])
+        url = resp[ARTISTS][NEXT]
     
     return artists
 
 
-def get_song_info(song_id) -> tuple[list[str], list[Any], str, str, Any, Any, Any, Any, Any, Any, Any, Any, Any, int]:
+def get_song_info(song_id) -> TrackMetadata:
     """ Retrieves metadata for downloaded songs """
     with Loader(PrintChannel.PROGRESS_INFO, "Fetching track information..."):
-        (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={song_id}&market=from_token')
+        track = MetadataStore.get_track(song_id)
     
-    if not TRACKS in info:
-        raise ValueError(f'Invalid response from TRACKS_URL:\n{raw}')
+    if track is None:
+        raise ValueError(f'Invalid response from TRACKS_URL for track {song_id}')
     
     try:
-        artists = []
-        for data in info[TRACKS][0][ARTISTS]:
-            artists.append(data[NAME])
-        
-        album_name = info[TRACKS][0][ALBUM][NAME]
-        album_artist = info[TRACKS][0][ALBUM][ARTISTS][0][NAME]
-        album_compilation = 1 if COMPILATION in info[TRACKS][0][ALBUM][ALBUM_TYPE] else 0
-        name = info[TRACKS][0][NAME]
-        release_year = info[TRACKS][0][ALBUM][RELEASE_DATE].split('-')[0]
-        disc_number = info[TRACKS][0][DISC_NUMBER]
-        track_number = info[TRACKS][0][TRACK_NUMBER]
-        total_tracks = info[TRACKS][0][ALBUM][TOTAL_TRACKS]
-        scraped_song_id = info[TRACKS][0][ID]
-        is_playable = info[TRACKS][0][IS_PLAYABLE]
-        duration_ms = info[TRACKS][0][DURATION_MS]
-        
-        image = info[TRACKS][0][ALBUM][IMAGES][0]
-        for i in info[TRACKS][0][ALBUM][IMAGES]:
-            if i[WIDTH] > image[WIDTH]:
-                image = i
-        image_url = image[URL]
-        
-        return artists, info[TRACKS][0][ARTISTS], album_name, album_artist, name, image_url, release_year, disc_number, track_number, total_tracks, album_compilation, scraped_song_id, is_playable, duration_ms
+        return TrackMetadata.from_track(track)
     except Exception as e:
-        raise ValueError(f'Failed to parse TRACKS_URL response: {str(e)}\n{raw}')
+        raise ValueError(f'Failed to parse TRACKS_URL response: {str(e)}\n{track}')
 
 
 def get_song_genres(rawartists: list[str], track_name: str) -> list[str]:
     if Zotify.CONFIG.get_save_genres():
-        try:
-            genres = []
-            for data in rawartists:
-                # query artist genres via href, which will be the api url
-                with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
-                    (raw, artistInfo) = Zotify.invoke_url(f'{data[HREF]}')
-                if Zotify.CONFIG.get_all_genres() and len(artistInfo[GENRES]) > 0:
-                    for genre in artistInfo[GENRES]:
-                        genres.append(genre)
-                elif len(artistInfo[GENRES]) > 0:
-                    genres.append(artistInfo[GENRES][0])
-
-            if len(genres) == 0:
-                Printer.print(PrintChannel.WARNINGS, '###    No Genres found for song ' + track_name)
-                genres.append('')
-
-            return genres
-        except Exception as e:
-            raise ValueError(f'Failed to parse GENRES response: {str(e)}\n{raw}')
+        genres = []
+        artist_ids = [data[ID] for data in rawartists]
+        # artists are cached for the run (and across runs with CACHE_LOCATION), misses are fetched together
+        with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
+            artist_genres = MetadataStore.get_artist_genres(artist_ids)
+        
+        for artist_id in artist_ids:
+            if artist_id not in artist_genres:
+                raise ValueError(f'Failed to fetch GENRES for artist: {artist_id}')
+            if Zotify.CONFIG.get_all_genres() and len(artist_genres[artist_id]) > 0:
+                for genre in artist_genres[artist_id]:
+                    genres.append(genre)
+            elif len(artist_genres[artist_id]) > 0:
+                genres.append(artist_genres[artist_id][0])
+        
+        if len(genres) == 0:
+            Printer.print(PrintChannel.WARNINGS, '###    No Genres found for song ' + track_name)
+            genres.append('')
+        
+        return genres
     else:
         return ['']
 
@@ -129,19 +150,6 @@ def get_song_lyrics(song_id: str) -> list[str]:
     raise ValueError(f'Failed to fetch lyrics: {song_id}')
 
 
-def get_song_duration(song_id: str) -> float:
-    """ Retrieves duration of song in second as is on spotify """
-
-    (raw, resp) = Zotify.invoke_url(f'{TRACK_STATS_URL}{song_id}')
-
-    # get duration in miliseconds
-    ms_duration = resp['duration_ms']
-    # convert to seconds
-    duration = float(ms_duration)/1000
-
-    return duration
-
-
 def handle_lyrics(track_id: str, song_name: str, filedir: PurePath) -> list[str] | None:
     lyrics = None
     try:
@@ -163,6 +171,8 @@ def handle_lyrics(track_id: str, song_name: str, filedir: PurePath) -> list[str]
 def download_track(mode: str, track_id: str, extra_keys: dict | None = None, wrapper_p_bars: list | None = None) -> None:
     """ Downloads raw song audio from Spotify """
     
+    requested_id = track_id
+    
     # recursive header for parent album download
     child_request_mode = mode
     child_request_id = track_id
@@ -172,9 +182,9 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, wra
         else:
             album_id = total_tracks = None
             try:
-                (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={track_id}&market=from_token')
-                album_id = info[TRACKS][0][ALBUM][ID]
-                total_tracks = info[TRACKS][0][ALBUM][TOTAL_TRACKS]
+                track = MetadataStore.get_track(track_id)
+                album_id = track[ALBUM][ID]
+                total_tracks = track[ALBUM][TOTAL_TRACKS]
             except:
                 Printer.print(PrintChannel.ERRORS, f'###   FAILED TO FIND PARENT ALBUM FOR TRACK_ID: {track_id}   ###')
                 Printer.print(PrintChannel.ERRORS, "\n")
@@ -186,69 +196,53 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, wra
     
     if extra_keys is None:
         extra_keys = {}
+    lyrics = None
+    partial = None
+    claimed = handed_off = False
     
     Printer.print(PrintChannel.PROGRESS_INFO, "\n")
     prepare_download_loader = Loader(PrintChannel.PROGRESS_INFO, "Preparing download...")
     prepare_download_loader.start()
     
     try:
-        output_template = Zotify.CONFIG.get_output(mode)
-        
-        (artists, raw_artists, album_name, album_artist, name, image_url, release_year, disc_number,
-         track_number, total_tracks, compilation, scraped_song_id, is_playable, duration_ms) = get_song_info(track_id)
-        total_discs = None
+        meta = get_song_info(track_id)
         if "total_discs" in extra_keys:
-            total_discs = extra_keys["total_discs"]
-        
-        song_name = fix_filename(artists[0]) + ' - ' + fix_filename(name)
+            meta.total_discs = extra_keys["total_discs"]
         
-        for k in extra_keys:
-            output_template = output_template.replace("{"+k+"}", fix_filename(extra_keys[k]))
+        song_name = fix_filename(meta.artists[0]) + ' - ' + fix_filename(meta.name)
         
         ext = EXT_MAP.get(Zotify.CONFIG.get_download_format().lower())
-        
-        output_template = output_template.replace("{artist}", fix_filename(artists[0]))
-        output_template = output_template.replace("{album_artist}", fix_filename(album_artist))
-        output_template = output_template.replace("{album}", fix_filename(album_name))
-        output_template = output_template.replace("{song_name}", fix_filename(name))
-        output_template = output_template.replace("{release_year}", fix_filename(release_year))
-        output_template = output_template.replace("{disc_number}", fix_filename(disc_number))
-        output_template = output_template.replace("{track_number}", '{:02d}'.format(int(fix_filename(track_number))))
-        output_template = output_template.replace("{total_tracks}", fix_filename(total_tracks))
-        output_template = output_template.replace("{id}", fix_filename(scraped_song_id))
-        output_template = output_template.replace("{track_id}", fix_filename(track_id))
-        output_template += f".{ext}"
-        
-        filename = PurePath(Zotify.CONFIG.get_root_path()).joinpath(output_template)
+        filename = get_track_filename(mode, track_id, meta, extra_keys)
         filedir = PurePath(filename).parent
         
-        filename_temp = filename
-        if Zotify.CONFIG.get_temp_download_dir() != '':
-            filename_temp = PurePath(Zotify.CONFIG.get_temp_download_dir()).joinpath(f'zotify_{str(uuid.uuid4())}_{track_id}.{ext}')
-        
-        check_name = Path(filename).is_file() and Path(filename).stat().st_size
-        check_local = scraped_song_id in get_directory_song_ids(filedir)
-        check_all_time = scraped_song_id in get_previously_downloaded()
-        if Zotify.CONFIG.get_disable_directory_archives():
-            check_local = not Zotify.CONFIG.get_skip_existing() or not Zotify.CONFIG.get_skip_previously_downloaded()
-            # avoids overwrite case only when both "safety switches" are on
+        check_name, check_local, check_all_time = get_archive_checks(meta, filename)
         
         # same filename, not same song_id, rename the newcomer
         if not check_local and check_name:
             c = len([file for file in Path(filedir).iterdir() if file.match(filename.stem + "*")])
             filename = PurePath(filedir).joinpath(f'{filename.stem}_{c}{filename.suffix}')
         
+        # named after the destination, so a rerun finds the partial file but two jobs never share one
+        filename_temp = filename
+        if Zotify.CONFIG.get_temp_download_dir() != '':
+            destination_hash = hashlib.sha1(str(filename).encode()).hexdigest()[:16]
+            filename_temp = PurePath(Zotify.CONFIG.get_temp_download_dir()).joinpath(f'zotify_{track_id}_{destination_hash}.{ext}')
+        
+        # m3u8 entries are written in collection order, even when tracks download concurrently
         if Zotify.CONFIG.get_export_m3u8() and track_id == child_request_id:
-            if child_request_mode == "liked" and Zotify.CONFIG.get_liked_songs_archive_m3u8():
-                m3u_path = filedir / "Liked Songs.m3u8"
-                songs_m3u = fetch_m3u8_songs(m3u_path)
-            song_label = add_to_m3u8(child_request_mode, get_song_duration(track_id), song_name, filename)
-            if child_request_mode == "liked" and Zotify.CONFIG.get_liked_songs_archive_m3u8():
-                if songs_m3u is not None and song_label in songs_m3u[0]:
-                    Zotify.CONFIG.Values[EXPORT_M3U8] = False
-                    Path(filedir / (Zotify.datetime_launch + "_zotify.m3u8")).replace(m3u_path)
-                    with open(m3u_path, 'a', encoding='utf-8') as file:
-                        file.writelines(songs_m3u[3:])
+            with DownloadPool.in_order():
+                # an earlier song may have switched the export off while this one waited
+                if Zotify.CONFIG.get_export_m3u8():
+                    if child_request_mode == "liked" and Zotify.CONFIG.get_liked_songs_archive_m3u8():
+                        m3u_path = filedir / "Liked Songs.m3u8"
+                        songs_m3u = fetch_m3u8_songs(m3u_path)
+                    song_label = add_to_m3u8(child_request_mode, meta.duration, song_name, filename)
+                    if child_request_mode == "liked" and Zotify.CONFIG.get_liked_songs_archive_m3u8():
+                        if songs_m3u is not None and song_label in songs_m3u[0]:
+                            Zotify.CONFIG.Values[EXPORT_M3U8] = False
+                            Path(filedir / (Zotify.datetime_launch + "_zotify.m3u8")).replace(m3u_path)
+                            with open(m3u_path, 'a', encoding='utf-8') as file:
+                                file.writelines(songs_m3u[3:])
         
         if Zotify.CONFIG.get_download_lyrics() and Zotify.CONFIG.get_always_check_lyrics():
             lyrics = handle_lyrics(track_id, song_name, filedir)
@@ -256,6 +250,7 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, wra
     except Exception as e:
         prepare_download_loader.stop()
         Printer.print(PrintChannel.ERRORS, f'###   SKIPPING SONG - FAILED TO QUERY METADATA - Track_ID: {str(track_id)}   ###')
+        SyncState.mark_failed(requested_id)
         Printer.print(PrintChannel.ERRORS, "Extra_Keys {" + ", ".join(f'"{it[0]}": "{it[1]}"' for it in extra_keys.items()) + "}")
         Printer.print(PrintChannel.ERRORS, "\n")
         Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()))
@@ -263,28 +258,29 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, wra
     
     else:
         try:
-            if not is_playable:
+            skip_reason = get_skip_reason(meta, check_name, check_local, check_all_time)
+            if skip_reason is not None:
                 prepare_download_loader.stop()
-                Printer.print(PrintChannel.SKIPS, f'###   SKIPPING: "{song_name}" (SONG IS UNAVAILABLE)   ###')
+                Printer.print(PrintChannel.SKIPS, f'###   SKIPPING: "{song_name}" ({skip_reason})   ###')
                 Printer.print(PrintChannel.SKIPS, "\n\n")
             else:
-                if check_local and check_name and Zotify.CONFIG.get_skip_existing() and not Zotify.CONFIG.get_disable_directory_archives():
-                    prepare_download_loader.stop()
-                    Printer.print(PrintChannel.SKIPS, f'###   SKIPPING: "{song_name}" (SONG ALREADY EXISTS)   ###')
-                    Printer.print(PrintChannel.SKIPS, "\n\n")
-                
-                elif check_all_time and Zotify.CONFIG.get_skip_previously_downloaded():
+                if not PartialDownload.claim(filename_temp):
+                    # e.g. a song listed twice in a playlist, whose first copy is still downloading or converting
                     prepare_download_loader.stop()
-                    Printer.print(PrintChannel.SKIPS, f'###   SKIPPING: "{song_name}" (SONG ALREADY DOWNLOADED ONCE)   ###')
+                    Printer.print(PrintChannel.SKIPS, f'###   SKIPPING: "{song_name}" (SONG IS ALREADY BEING DOWNLOADED)   ###')
                     Printer.print(PrintChannel.SKIPS, "\n\n")
                 
                 else:
-                    if track_id != scraped_song_id:
-                        track_id = scraped_song_id
+                    claimed = True
+                    if track_id != meta.id:
+                        track_id = meta.id
                     track = TrackId.from_base62(track_id)
-                    stream = Zotify.get_content_stream(track, Zotify.DOWNLOAD_QUALITY)
+                    stream = StreamPrefetcher.take(requested_id) or Zotify.get_content_stream(track, Zotify.DOWNLOAD_QUALITY)
                     create_download_directory(filedir)
-                    total_size = stream.input_stream.size
+                    source = stream.input_stream.stream()
+                    # librespot has already skipped the file header, only the rest of the file is delivered
+                    header_size = source.pos()
+                    total_size = stream.input_stream.size - header_size
                     
                     prepare_download_loader.stop()
                     
@@ -295,64 +291,107 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, wra
                         pos = wrapper_p_bars[-1] if type(wrapper_p_bars[-1]) is int else -(wrapper_p_bars[-1].pos + 2)
                         for bar in wrapper_p_bars:
                             if type(bar) != int: bar.refresh()
-                    with open(filename_temp, 'wb') as file, Printer.progress(
-                            desc=song_name,
-                            total=total_size,
-                            unit='B',
-                            unit_scale=True,
-                            unit_divisor=1024,
-                            disable=not Zotify.CONFIG.get_show_download_pbar(),
-                            pos=pos
-                    ) as p_bar:
-                        b = 0
-                        while b < 5:
-                        #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
-                            data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
-                            p_bar.update(file.write(data))
-                            downloaded += len(data)
-                            b += 1 if data == b'' else 0
-                            if Zotify.CONFIG.get_download_real_time():
-                                delta_real = time.time() - time_start
-                                delta_want = (downloaded / total_size) * (duration_ms/1000)
-                                if delta_want > delta_real:
-                                    time.sleep(delta_want - delta_real)
+                    pos = DownloadPool.bar_position(pos, wrapper_p_bars)
+                    
+                    bitrate = get_transcode_bitrate()
+                    ffmpeg = start_conversion_stream(filename_temp, bitrate) if Zotify.CONFIG.get_stream_conversion() else None
+                    
+                    # downloads into TEMP_DOWNLOAD_DIR continue where an interrupted run stopped
+                    file_id = get_stream_file_id(stream)
+                    if ffmpeg is None and filename_temp != filename and file_id is not None:
+                        partial = PartialDownload(filename_temp, track_id, file_id)
+                        downloaded = partial.offset()
+                    
+                    if ffmpeg is not None:
+                        file = ffmpeg.stdin
+                    elif downloaded:
+                        file = open(filename_temp, 'r+b')
+                        file.truncate(downloaded)
+                        file.seek(downloaded)
+                        # librespot seeks to absolute file positions, the temp file starts after the header
+                        source.seek(header_size + downloaded)
+                    else:
+                        file = open(filename_temp, 'wb')
+                    
+                    try:
+                        with file, Printer.progress(
+                                desc=song_name,
+                                total=total_size,
+                                unit='B',
+                                unit_scale=True,
+                                unit_divisor=1024,
+                                disable=not Zotify.CONFIG.get_show_download_pbar(),
+                                pos=pos
+                        ) as p_bar:
+                            p_bar.update(downloaded)
+                            copier = StreamCopier(source, file, Zotify.CONFIG.get_chunk_size())
+                            downloaded = copier.copy_resuming(lambda offset: reopen_stream(track, offset, song_name),
+                                                              Zotify.CONFIG.get_retry_attempts(), p_bar, total_size, downloaded,
+                                                              duration=meta.duration if Zotify.CONFIG.get_download_real_time() else None,
+                                                              checkpoint=partial.save if partial is not None else None)
+                    except BaseException:
+                        if ffmpeg is not None:
+                            ffmpeg.kill()
+                        raise
+                    
+                    if ffmpeg is not None and ffmpeg.wait() != 0:
+                        raise RuntimeError(f'FFMPEG exited with code {ffmpeg.returncode} while converting the stream')
+                    
+                    if partial is not None:
+                        partial.remove()
+                        partial = None
                     
                     time_downloaded = time.time()
                     
-                    genres = get_song_genres(raw_artists, name)
+                    meta.genres = get_song_genres(meta.raw_artists, meta.name)
                     
                     if Zotify.CONFIG.get_download_lyrics() and not Zotify.CONFIG.get_always_check_lyrics():
                         lyrics = handle_lyrics(track_id, song_name, filedir)
                     
-                    # no metadata is written to track prior to conversion
-                    convert_audio_format(filename_temp)
-                    
+                    image = None
                     try:
-                        set_audio_tags(filename_temp, artists, genres, name, album_name, album_artist, release_year, 
-                                       disc_number, track_number, total_tracks, total_discs, compilation, lyrics)
-                        set_music_thumbnail(filename_temp, image_url, mode)
+                        image = set_music_thumbnail(filename, meta.image_url, mode)
                     except Exception:
-                        Printer.print(PrintChannel.ERRORS, "\n")
-                        Printer.print(PrintChannel.ERRORS, "Unable to write metadata, ensure FFMPEG is installed and added to your PATH.")
-                        Printer.print(PrintChannel.ERRORS, "\n")
+                        Printer.print(PrintChannel.WARNINGS, f'###   SKIPPING: COVER ART FOR "{song_name}" (FAILED TO FETCH IMAGE)   ###')
                     
-                    if filename_temp != filename:
-                        if Path(filename).exists():
-                            Path(filename).unlink()
-                        Path(filename_temp).rename(filename)
+                    def finish_download(future: Future) -> None:
+                        """ Moves the converted track into place and records it in the archives """
+                        try:
+                            future.result()
+                            
+                            if filename_temp != filename:
+                                if Path(filename).exists():
+                                    Path(filename).unlink()
+                                Path(filename_temp).rename(filename)
+                            
+                            time_finished = time.time()
+                            
+                            Printer.print(PrintChannel.DOWNLOADS, f'###   DOWNLOADED: "{song_name}" TO "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}" IN {fmt_seconds(time_downloaded - time_start)} (PLUS {fmt_seconds(time_finished - time_downloaded)} CONVERTING)   ###')
+                            Printer.print(PrintChannel.DOWNLOADS, "\n\n")
+                            
+                            # add song ID to global .song_archive file
+                            if Zotify.CONFIG.get_skip_previously_downloaded() or Zotify.CONFIG.get_disable_directory_archives():
+                                if not check_all_time:
+                                    add_to_archive(meta.id, PurePath(filename).name, meta.artists[0], meta.name)
+                            # add song ID to download directory's .song_ids file
+                            if not check_local:
+                                add_to_directory_song_ids(filedir, meta.id, PurePath(filename).name, meta.artists[0], meta.name)
+                        
+                        except Exception as e:
+                            Printer.print(PrintChannel.ERRORS, f'###   SKIPPING: {song_name} (GENERAL CONVERSION ERROR) - Track_ID: {str(track_id)}   ###')
+                            SyncState.mark_failed(requested_id)
+                            Printer.print(PrintChannel.ERRORS, "\n")
+                            Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()))
+                            Printer.print(PrintChannel.ERRORS, "\n\n")
+                            if Path(filename_temp).exists():
+                                Path(filename_temp).unlink()
+                        finally:
+                            PartialDownload.release(filename_temp)
                     
-                    time_finished = time.time()
-                    
-                    Printer.print(PrintChannel.DOWNLOADS, f'###   DOWNLOADED: "{song_name}" TO "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}" IN {fmt_seconds(time_downloaded - time_start)} (PLUS {fmt_seconds(time_finished - time_downloaded)} CONVERTING)   ###')
-                    Printer.print(PrintChannel.DOWNLOADS, "\n\n")
-
-                    # add song ID to global .song_archive file
-                    if Zotify.CONFIG.get_skip_previously_downloaded() or Zotify.CONFIG.get_disable_directory_archives():
-                        if not check_all_time:
-                            add_to_archive(scraped_song_id, PurePath(filename).name, artists[0], name)
-                    # add song ID to download directory's .song_ids file
-                    if not check_local:
-                        add_to_directory_song_ids(filedir, scraped_song_id, PurePath(filename).name, artists[0], name)
+                    # conversion and tagging run in the post-processing stage, the next track can start downloading
+                    meta.lyrics = lyrics
+                    PostProcessor.submit(postprocess_track, finish_download, filename_temp, bitrate, image, meta, ffmpeg is not None)
+                    handed_off = True
                     
                     wait_between_downloads()
             
@@ -360,12 +399,16 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, wra
             
         except Exception as e:
             Printer.print(PrintChannel.ERRORS, f'###   SKIPPING: {song_name} (GENERAL DOWNLOAD ERROR) - Track_ID: {str(track_id)}   ###')
+            SyncState.mark_failed(requested_id)
             Printer.print(PrintChannel.ERRORS, "Extra_Keys {" + ", ".join(f'"{it[0]}": "{it[1]}"' for it in extra_keys.items()) + "}")
             Printer.print(PrintChannel.ERRORS, "\n")
             Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()))
             Printer.print(PrintChannel.ERRORS, "\n\n")
-            if Path(filename_temp).exists():
-                Path(filename_temp).unlink()
+            # a partial download is kept for the next run to resume
+            if claimed and not handed_off:
+                if partial is None and Path(filename_temp).exists():
+                    Path(filename_temp).unlink()
+                PartialDownload.release(filename_temp)
 
     prepare_download_loader.stop()
     Printer.print(PrintChannel.ERRORS, "\n")
@@ -374,28 +417,148 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, wra
 
 
 
-def convert_audio_format(filename) -> None:
-    """ Converts raw audio into playable file """
-    temp_filename = f'{PurePath(filename).parent}.tmp'
-    Path(filename).replace(temp_filename)
+def get_track_filename(mode: str, track_id: str, meta: TrackMetadata, extra_keys: dict) -> PurePath:
+    """ Returns the path the OUTPUT template gives the track, before renaming a clashing filename """
+    output_template = Zotify.CONFIG.get_output(mode)
+    
+    for k in extra_keys:
+        output_template = output_template.replace("{"+k+"}", fix_filename(extra_keys[k]))
+    
+    ext = EXT_MAP.get(Zotify.CONFIG.get_download_format().lower())
     
+    output_template = output_template.replace("{artist}", fix_filename(meta.artists[0]))
+    output_template = output_template.replace("{album_artist}", fix_filename(meta.album_artist))
+    output_template = output_template.replace("{album}", fix_filename(meta.album_name))
+    output_template = output_template.replace("{song_name}", fix_filename(meta.name))
+    output_template = output_template.replace("{release_year}", fix_filename(meta.release_year))
+    output_template = output_template.replace("{disc_number}", fix_filename(meta.disc_number))
+    output_template = output_template.replace("{track_number}", '{:02d}'.format(int(fix_filename(meta.track_number))))
+    output_template = output_template.replace("{total_tracks}", fix_filename(meta.total_tracks))
+    output_template = output_template.replace("{id}", fix_filename(meta.id))
+    output_template = output_template.replace("{track_id}", fix_filename(track_id))
+    output_template += f".{ext}"
+    
+    return PurePath(Zotify.CONFIG.get_root_path()).joinpath(output_template)
+
+
+def get_archive_checks(meta: TrackMetadata, filename: PurePath) -> tuple:
+    """ Returns whether filename is taken, and whether the track is in its directory's and the global archive """
+    check_name = Path(filename).is_file() and Path(filename).stat().st_size
+    check_local = meta.id in get_directory_song_ids(PurePath(filename).parent)
+    check_all_time = meta.id in get_previously_downloaded()
+    if Zotify.CONFIG.get_disable_directory_archives():
+        check_local = not Zotify.CONFIG.get_skip_existing() or not Zotify.CONFIG.get_skip_previously_downloaded()
+        # avoids overwrite case only when both "safety switches" are on
+    return check_name, check_local, check_all_time
+
+
+def get_skip_reason(meta: TrackMetadata, check_name, check_local, check_all_time) -> str | None:
+    """ Returns why download_track skips the track, None if it is downloaded """
+    if not meta.is_playable:
+        return "SONG IS UNAVAILABLE"
+    if check_local and check_name and Zotify.CONFIG.get_skip_existing() and not Zotify.CONFIG.get_disable_directory_archives():
+        return "SONG ALREADY EXISTS"
+    if check_all_time and Zotify.CONFIG.get_skip_previously_downloaded():
+        return "SONG ALREADY DOWNLOADED ONCE"
+    return None
+
+
+def will_download(mode: str, track_id: str, extra_keys: dict | None = None) -> bool:
+    """ Whether download_track would download the track rather than skip it, decides on prefetching its stream """
+    extra_keys = dict(extra_keys or {})
+    bypass = extra_keys.pop("M3U8_bypass", None)
+    track = MetadataStore.get_track(track_id)
+    if track is None:
+        return False
+    if Zotify.CONFIG.get_download_parent_album() and not (mode == "album" and bypass is not None) \
+        and int(track[ALBUM][TOTAL_TRACKS]) > 1:
+        # download_track hands the track to its album's collection, which prefetches it itself
+        return False
+    meta = TrackMetadata.from_track(track)
+    filename = get_track_filename(mode, track_id, meta, extra_keys)
+    return get_skip_reason(meta, *get_archive_checks(meta, filename)) is None
+
+
+def reopen_stream(content_id, offset: int, name: str):
+    """ Opens a new stream of the same content after one ended early, positioned at offset """
+    Printer.print(PrintChannel.WARNINGS, f'###   STREAM OF "{name}" ENDED EARLY, RESUMING AT BYTE {offset}   ###')
+    source = Zotify.get_content_stream(content_id, Zotify.DOWNLOAD_QUALITY).input_stream.stream()
+    # offset counts copied bytes, the new stream is positioned after the skipped file header
+    source.seek(source.pos() + offset)
+    return source
+
+
+def get_stream_file_id(stream) -> str | None:
+    """ Returns the id of the audio file a track stream reads from, None if it cannot be told """
+    try:
+        return VorbisOnlyAudioQuality(Zotify.DOWNLOAD_QUALITY).get_file(stream.track.file).file_id.hex()
+    except AttributeError:
+        return None
+
+
+def get_transcode_bitrate() -> str | None:
+    """ Returns the FFMPEG quality setting for the configured codec, None when remuxing """
+    download_format = Zotify.CONFIG.get_download_format().lower()
+    if CODEC_MAP.get(download_format, 'copy') == 'copy':
+        return None
+    
+    bitrate = Zotify.CONFIG.get_transcode_bitrate()
+    if bitrate in {"auto", ""}:
+        bitrates = {
+            'auto': '0' if Zotify.check_premium() else '2',
+            'normal': '3',
+            'high': '2',
+            'very_high': '0'
+        }
+        bitrate = bitrates[Zotify.CONFIG.get_download_quality()]
+    return bitrate
+
+
+def postprocess_track(filename, bitrate: str | None, image: bytes | None, meta: TrackMetadata, converted: bool = False) -> None:
+    """ Converts and tags a downloaded track, may run in a post-processing worker process """
+    
+    # no metadata is written to track prior to conversion
+    if not converted:
+        convert_audio_format(filename, bitrate)
+    
+    try:
+        set_audio_tags(filename, meta.artists, meta.genres, meta.name, meta.album_name, meta.album_artist, meta.release_year,
+                       meta.disc_number, meta.track_number, meta.total_tracks, meta.total_discs, meta.compilation, meta.lyrics, image)
+    except Exception:
+        Printer.print(PrintChannel.ERRORS, "\n")
+        Printer.print(PrintChannel.ERRORS, "Unable to write metadata, ensure FFMPEG is installed and added to your PATH.")
+        Printer.print(PrintChannel.ERRORS, "\n")
+
+
+def get_conversion_params(bitrate: str | None) -> list[str]:
+    """ Returns the FFMPEG output options for the configured codec """
     download_format = Zotify.CONFIG.get_download_format().lower()
     file_codec = CODEC_MAP.get(download_format, 'copy')
-    bitrate = None
-    if file_codec != 'copy':
-        bitrate = Zotify.CONFIG.get_transcode_bitrate()
-        if bitrate in {"auto", ""}:
-            bitrates = {
-                'auto': '0' if Zotify.check_premium() else '2',
-                'normal': '3',
-                'high': '2',
-                'very_high': '0'
-            }
-            bitrate = bitrates[Zotify.CONFIG.get_download_quality()]
     
     output_params = ['-c:a', file_codec]
     if bitrate is not None:
         output_params += ['-q:a', bitrate]
+    return output_params
+
+
+def start_conversion_stream(filename, bitrate: str | None) -> subprocess.Popen | None:
+    """ Starts FFMPEG converting raw audio written to its stdin, returns None if FFMPEG is not installed """
+    command = ['ffmpeg', '-y', '-hide_banner', '-loglevel', Zotify.CONFIG.get_ffmpeg_log_level(),
+               '-i', 'pipe:0', *get_conversion_params(bitrate), str(filename)]
+    try:
+        return subprocess.Popen(command, stdin=subprocess.PIPE)
+    except FileNotFoundError:
+        # the raw stream is written to disk and conversion falls back to convert_audio_format
+        return None
+
+
+def convert_audio_format(filename, bitrate: str | None) -> None:
+    """ Converts raw audio into playable file """
+    temp_filename = str(PurePath(filename).with_suffix('.tmp'))
+    Path(filename).replace(temp_filename)
+    
+    output_params = get_conversion_params(bitrate)
+    file_codec = output_params[1]
     
     try:
         ff_m = ffmpy.FFmpeg(
@@ -410,4 +573,5 @@ def convert_audio_format(filename) -> None:
             Path(temp_filename).unlink()
     
     except ffmpy.FFExecutableNotFoundError:
+        Path(temp_filename).replace(filename)
         Printer.print(PrintChannel.WARNINGS, f'###   SKIPPING {file_codec.upper()} CONVERSION - FFMPEG NOT FOUND   ###')
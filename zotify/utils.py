@@ -1,4 +1,5 @@
 import datetime
+import json
 import math
 import os
 import platform
@@ -6,12 +7,13 @@ import re
 import subprocess
 import time
 from pathlib import Path, PurePath
+from threading import Lock
 
 import music_tag
-import requests
 
 from zotify.const import ARTIST, GENRE, TRACKTITLE, ALBUM, YEAR, DISCNUMBER, TRACKNUMBER, ARTWORK, \
     WINDOWS_SYSTEM, ALBUMARTIST, TOTALTRACKS, TOTALDISCS, EXT_MAP, LYRICS, COMPILATION
+from zotify.cache import CoverArtCache
 from zotify.zotify import Zotify
 from zotify.termoutput import PrintChannel, Printer
 
@@ -19,40 +21,48 @@ from zotify.termoutput import PrintChannel, Printer
 def create_download_directory(download_path: str | PurePath) -> None:
     """ Create directory and add a hidden file with song ids """
     Path(download_path).mkdir(parents=True, exist_ok=True)
-
+    
     # add hidden file with song ids
-    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
     if Zotify.CONFIG.get_disable_directory_archives():
         return
-    if not Path(hidden_file_path).is_file():
-        with open(hidden_file_path, 'w', encoding='utf-8') as f:
-            pass
-
-
-def get_previously_downloaded() -> list[str]:
-    """ Returns list of all time downloaded songs """
-
-    ids = []
-    archive_path = Zotify.CONFIG.get_song_archive_location()
+    DirectoryArchive.create(download_path)
+
+
+class SongArchive:
+    """ The global song archive, parsed once per run into a set of song ids """
+    _ids: set[str] | None = None
+    _path: PurePath | None = None
+    _lock = Lock()
+    
+    @classmethod
+    def ids(cls) -> set[str]:
+        archive_path = Zotify.CONFIG.get_song_archive_location()
+        with cls._lock:
+            if cls._ids is None or cls._path != archive_path:
+                cls._ids = set()
+                cls._path = archive_path
+                if Path(archive_path).exists():
+                    with open(archive_path, 'r', encoding='utf-8') as f:
+                        cls._ids.update(line.strip().split('\t')[0] for line in f)
+            return cls._ids
+    
+    @classmethod
+    def add(cls, song_id: str, filename: str, author_name: str, song_name: str) -> None:
+        ids = cls.ids()
+        # the file keeps the tab separated format, appending never requires reading it again
+        with cls._lock, open(cls._path, 'a', encoding='utf-8') as file:
+            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+            ids.add(song_id)
 
-    if Path(archive_path).exists():
-        with open(archive_path, 'r', encoding='utf-8') as f:
-            ids = [line.strip().split('\t')[0] for line in f.readlines()]
 
-    return ids
+def get_previously_downloaded() -> set[str]:
+    """ Returns set of all time downloaded songs """
+    return SongArchive.ids()
 
 
 def add_to_archive(song_id: str, filename: str, author_name: str, song_name: str) -> None:
     """ Adds song id to all time installed songs archive """
-    
-    archive_path = Zotify.CONFIG.get_song_archive_location()
-    
-    if Path(archive_path).exists():
-        with open(archive_path, 'a', encoding='utf-8') as file:
-            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
-    else:
-        with open(archive_path, 'w', encoding='utf-8') as file:
-            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+    SongArchive.add(song_id, filename, author_name, song_name)
 
 
 def add_to_m3u8(mode: str, song_duration: float, song_name: str, song_path: PurePath) -> str | None:
@@ -100,30 +110,127 @@ def fetch_m3u8_songs(m3u_path: PurePath) -> list[str] | None:
     return linesraw
 
 
-def get_directory_song_ids(download_path: str) -> list[str]:
-    """ Gets song ids of songs in directory """
-    
-    song_ids = []
+class DirectoryArchive:
+    """ In-process index of the .song_ids files of download directories, shared by all workers """
+    _dirs: dict[PurePath, dict] = {}
+    _lock = Lock()
     
-    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
-    
-    if Path(hidden_file_path).is_file() and not Zotify.CONFIG.get_disable_directory_archives():
-        with open(hidden_file_path, 'r', encoding='utf-8') as file:
-            song_ids.extend([line.strip().split('\t')[0] for line in file.readlines()])
+    @classmethod
+    def _entry(cls, download_path: str | PurePath) -> dict:
+        """ Returns the cached index of a directory, (re)loading it if the file changed outside of this process """
+        hidden_file_path = PurePath(download_path).joinpath('.song_ids')
+        try:
+            mtime = Path(hidden_file_path).stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        
+        entry = cls._dirs.get(hidden_file_path)
+        if entry is None or entry['mtime'] != mtime:
+            ids = set()
+            if mtime is not None:
+                with open(hidden_file_path, 'r', encoding='utf-8') as file:
+                    ids.update(line.strip().split('\t')[0] for line in file)
+            entry = {'path': hidden_file_path, 'ids': ids, 'mtime': mtime}
+            cls._dirs[hidden_file_path] = entry
+        return entry
+    
+    @classmethod
+    def create(cls, download_path: str | PurePath) -> None:
+        hidden_file_path = PurePath(download_path).joinpath('.song_ids')
+        with cls._lock:
+            if hidden_file_path in cls._dirs and cls._dirs[hidden_file_path]['mtime'] is not None:
+                return
+            if not Path(hidden_file_path).is_file():
+                with open(hidden_file_path, 'w', encoding='utf-8') as f:
+                    pass
+            cls._entry(download_path)
+    
+    @classmethod
+    def ids(cls, download_path: str | PurePath) -> set[str]:
+        # the live set is returned, membership checks stay cheap even for a Liked Songs directory
+        with cls._lock:
+            return cls._entry(download_path)['ids']
+    
+    @classmethod
+    def add(cls, download_path: str | PurePath, song_id: str, filename: str, author_name: str, song_name: str) -> None:
+        with cls._lock:
+            entry = cls._entry(download_path)
+            # not checking if file exists because we need an exception
+            # to be raised if something is wrong
+            if entry['mtime'] is None:
+                raise FileNotFoundError(entry['path'])
+            # written right away, a killed run must not forget songs whose files are already in place
+            with open(entry['path'], 'a', encoding='utf-8') as file:
+                file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+            entry['ids'].add(song_id)
+            entry['mtime'] = Path(entry['path']).stat().st_mtime_ns
+
+
+def get_directory_song_ids(download_path: str) -> set[str]:
+    """ Gets song ids of songs in directory """
     
-    return song_ids
+    if Zotify.CONFIG.get_disable_directory_archives():
+        return set()
+    return DirectoryArchive.ids(download_path)
 
 
 def add_to_directory_song_ids(download_path: str, song_id: str, filename: str, author_name: str, song_name: str) -> None:
     """ Appends song_id to .song_ids file in directory """
     
-    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
     if Zotify.CONFIG.get_disable_directory_archives():
         return
-    # not checking if file exists because we need an exception
-    # to be raised if something is wrong
-    with open(hidden_file_path, 'a', encoding='utf-8') as file:
-        file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+    DirectoryArchive.add(download_path, song_id, filename, author_name, song_name)
+
+
+class PartialDownload:
+    """A download kept in TEMP_DOWNLOAD_DIR with a sidecar file recording how far it got.
+
+    The sidecar names the track and the audio file it was read from, so a later run only
+    continues the partial file when it would receive the very same bytes.
+    """
+    _claimed: set[Path] = set()
+    _claim_lock = Lock()
+    
+    @classmethod
+    def claim(cls, path: PurePath) -> bool:
+        """ Reserves a temp path for one job of this run, False if another job is still using it """
+        with cls._claim_lock:
+            if Path(path) in cls._claimed:
+                return False
+            cls._claimed.add(Path(path))
+            return True
+    
+    @classmethod
+    def release(cls, path: PurePath) -> None:
+        with cls._claim_lock:
+            cls._claimed.discard(Path(path))
+    
+    def __init__(self, path: PurePath, track_id: str, file_id: str):
+        self.path = Path(path)
+        self.sidecar = self.path.with_name(self.path.name + '.json')
+        self.track_id = track_id
+        self.file_id = file_id
+    
+    def offset(self) -> int:
+        """ Returns the number of bytes that can be kept, 0 if there is nothing to resume """
+        try:
+            with open(self.sidecar, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            if state['track_id'] != self.track_id or state['file_id'] != self.file_id:
+                return 0
+            # bytes written after the last save are dropped, they may not have reached the disk
+            return min(int(state['offset']), self.path.stat().st_size)
+        except (OSError, ValueError, KeyError):
+            return 0
+    
+    def save(self, offset: int) -> None:
+        temp_path = self.sidecar.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'track_id': self.track_id, 'file_id': self.file_id, 'offset': offset}, file)
+        temp_path.replace(self.sidecar)
+    
+    def remove(self) -> None:
+        self.sidecar.unlink(missing_ok=True)
 
 
 def get_downloaded_song_duration(filename: str) -> float:
@@ -171,8 +278,8 @@ def clear() -> None:
         os.system('clear')
 
 
-def set_audio_tags(filename, artists: list[str], genres: list[str], name, album_name, album_artist, release_year, disc_number, track_number, total_tracks, total_discs, compilation: int, lyrics: list[str] | None) -> None:
-    """ sets music_tag metadata """
+def set_audio_tags(filename, artists: list[str], genres: list[str], name, album_name, album_artist, release_year, disc_number, track_number, total_tracks, total_discs, compilation: int, lyrics: list[str] | None, image: bytes | None = None) -> None:
+    """ sets music_tag metadata and cover artwork, saving the file only once """
     tags = music_tag.load_file(filename)
     tags[ALBUMARTIST] = album_artist
     tags[ARTIST] = conv_artist_format(artists)
@@ -201,6 +308,9 @@ def set_audio_tags(filename, artists: list[str], genres: list[str], name, album_
     if lyrics and Zotify.CONFIG.get_save_lyrics_tags():
         tags[LYRICS] = "".join(lyrics)
     
+    if image is not None:
+        tags[ARTWORK] = image
+    
     tags.save()
 
 
@@ -223,30 +333,18 @@ def conv_genre_format(genres: list[str]) -> list[str] | str:
         return Zotify.CONFIG.get_genre_delimiter().join(genres)
 
 
-def set_music_thumbnail(filename: PurePath, image_url, mode: str) -> None:
-    """ Fetch an album cover image, set album cover tag, and save to file if desired """
+def set_music_thumbnail(filename: PurePath, image_url, mode: str) -> bytes:
+    """ Fetch an album cover image and save to file if desired, returns the image for the cover tag """
     
-    # jpeg format expected from request
-    img = requests.get(image_url).content
-    set_music_thumbnail_tag(filename, img)
+    img = CoverArtCache.get(image_url)
     
     if not Zotify.CONFIG.get_album_art_jpg_file():
-        return
+        return img
     
     jpg_filename = 'cover.jpg' if '{album}' in Zotify.CONFIG.get_output(mode) else filename.stem + '.jpg'
     jpg_path = Path(filename).parent.joinpath(jpg_filename)
-    
-    if not jpg_path.exists():
-        with open(jpg_path, 'wb') as jpg_file:
-            jpg_file.write(img)
-
-
-def set_music_thumbnail_tag(filename, img: bytes) -> None:
-    """ Sets an image as a music file's cover artwork """
-    
-    tags = music_tag.load_file(filename)
-    tags[ARTWORK] = img
-    tags.save()
+    CoverArtCache.write_jpg(jpg_path, img)
+    return img
 
 
 def regex_input_for_urls(search_input) -> tuple[str, str, str, str, str, str]:
@@ -390,11 +488,20 @@ def strptime_utc(dtstr) -> datetime.datetime:
     return datetime.datetime.strptime(dtstr[:-1], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
 
 
+_bulk_wait_lock = Lock()
+
+
 def wait_between_downloads() -> None:
+    if Zotify.CONFIG.get_adaptive_rate_limit():
+        # streams are paced by Zotify.STREAM_LIMITER instead
+        return
+    
     waittime = Zotify.CONFIG.get_bulk_wait_time()
     if not waittime or waittime <= 0:
         return
     
-    if waittime > 5:
-        Printer.print(PrintChannel.DOWNLOADS, f'###   WAITING FOR {waittime} SECONDS BETWEEN DOWNLOADS   ###')
-    time.sleep(waittime)
\ No newline at end of file
+    # shared by every download worker, so more workers do not open streams any faster
+    with _bulk_wait_lock:
+        if waittime > 5:
+            Printer.print(PrintChannel.DOWNLOADS, f'###   WAITING FOR {waittime} SECONDS BETWEEN DOWNLOADS   ###')
+        time.sleep(waittime)
\ No newline at end of file
@@ -1,22 +1,34 @@
 import json
+import requests
 from pathlib import Path
 import datetime, time
-import requests
 from librespot.audio.decoders import VorbisOnlyAudioQuality
 
 from zotify import OAuth, Session
 from zotify.const import TYPE, \
     PREMIUM, USER_READ_EMAIL, OFFSET, LIMIT, \
-    PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ
+    PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ, ERROR
 from zotify.config import Config
+from zotify.network import HttpClient, RateLimiter, RetryPolicy, ResponseCache, NOT_MODIFIED, TOO_MANY_REQUESTS, \
+    MIN_RETRY_ATTEMPTS
 
 class Zotify:    
     SESSION: Session = None
     DOWNLOAD_QUALITY = None
     CONFIG: Config = Config()
+    STREAM_LIMITER = RateLimiter(rate=1.0, min_rate=1.0, max_rate=1.0, step=0.0)
+    RETRY_POLICY = RetryPolicy()
+    RESPONSE_CACHE: ResponseCache | None = None
     
     def __init__(self, args):
         Zotify.CONFIG.load(args)
+        HttpClient.configure(2 * Zotify.CONFIG.get_download_workers())
+        # adaptive pacing starts at the configured wait and speeds up while audio streams keep loading
+        start_rate = 1 / max(Zotify.CONFIG.get_bulk_wait_time(), 1)
+        Zotify.STREAM_LIMITER.reset(rate=start_rate, min_rate=start_rate / 4, max_rate=2.0, step=start_rate / 2)
+        cache_dir = Zotify.CONFIG.get_cache_location()
+        if Zotify.CONFIG.get_http_cache() and cache_dir is not None:
+            Zotify.RESPONSE_CACHE = ResponseCache(Path(cache_dir) / 'responses.sqlite3', Zotify.CONFIG.get_http_cache_size() * 1024 * 1024)
         Zotify.login(args)
         Zotify.datetime_launch = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     
@@ -49,7 +61,20 @@ class Zotify:
     
     @classmethod
     def get_content_stream(cls, content_id, quality):
-        return cls.SESSION.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality), False, None)
+        if not cls.CONFIG.get_adaptive_rate_limit():
+            return cls.SESSION.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality), False, None)
+        
+        from zotify.termoutput import Printer, PrintChannel
+        cls.STREAM_LIMITER.acquire()
+        try:
+            stream = cls.SESSION.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality), False, None)
+        except Exception:
+            # audio key and CDN failures are how throttling shows up for streams
+            cls.STREAM_LIMITER.throttled()
+            Printer.print(PrintChannel.WARNINGS, f'###   FAILED TO LOAD STREAM, SLOWING DOWN TO {cls.STREAM_LIMITER.rate * 60:.1f} STREAMS PER MINUTE   ###')
+            raise
+        cls.STREAM_LIMITER.success()
+        return stream
     
     @classmethod
     def __get_auth_token(cls):
@@ -69,32 +94,86 @@ class Zotify:
     
     @classmethod
     def invoke_url_with_params(cls, url, limit, offset, **kwargs):
-        headers = cls.get_auth_header()
         params = {LIMIT: limit, OFFSET: offset}
         params.update(kwargs)
-        return requests.get(url, headers=headers, params=params).json()
+        responsetext, responsejson = cls.__invoke(url, params)
+        if not responsejson or ERROR in responsejson:
+            raise requests.HTTPError(f"Spotify API Error ({responsejson[ERROR]['status']}): {responsejson[ERROR]['message']}\n{url}")
+        return responsejson
+    
+    @classmethod
+    def invoke_url(cls, url):
+        return cls.__invoke(url)
     
     @classmethod
-    def invoke_url(cls, url, tryCount=0):
+    def __invoke(cls, url, params=None):
         # we need to import that here, otherwise we will get circular imports!
         from zotify.termoutput import Printer, PrintChannel
-        headers = cls.get_auth_header()
-        response = requests.get(url, headers=headers)
-        responsetext = response.text
-        try:
-            responsejson = response.json()
-        except json.decoder.JSONDecodeError:
-            responsejson = {"error": {"status": "unknown", "message": "received an empty response"}}
+        policy = cls.RETRY_POLICY
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
         
-        if not responsejson or 'error' in responsejson:
-            if tryCount < (cls.CONFIG.get_retry_attempts() - 1):
-                Printer.print(PrintChannel.WARNINGS, f"Spotify API Error (try {tryCount + 1}) ({responsejson['error']['status']}): {responsejson['error']['message']}")
-                time.sleep(5)
-                return cls.invoke_url(url, tryCount + 1)
-            
-            Printer.print(PrintChannel.API_ERRORS, f"Spotify API Error ({responsejson['error']['status']}): {responsejson['error']['message']}")
+        # only single-resource lookups are cached, paginated collections change too often
+        cache = cls.RESPONSE_CACHE if params is None else None
+        ttl = cache.ttl(url) if cache is not None else None
+        cached = None
+        if ttl is not None:
+            cache_key = cache.key(url, cls.CONFIG.get_language())
+            cached = cache.get(cache_key)
+            if cached is not None and cached[2]:
+                return cached[0], json.loads(cached[0])
         
-        return responsetext, responsejson
+        while True:
+            policy.wait_for_circuit()
+            status = None
+            try:
+                headers = cls.get_auth_header()
+                if cached is not None and cached[1]:
+                    headers['If-None-Match'] = cached[1]
+                response = HttpClient.get(url, headers=headers, params=params)
+                status = response.status_code
+                if status == NOT_MODIFIED and cached is not None:
+                    policy.success()
+                    cache.refresh(cache_key, ttl)
+                    return cached[0], json.loads(cached[0])
+                responsetext = response.text
+                responsejson = response.json()
+                if not 200 <= status < 300:
+                    # the status decides, whatever the body says
+                    body_error = responsejson.get(ERROR) if isinstance(responsejson, dict) else None
+                    message = body_error.get('message') if isinstance(body_error, dict) else body_error
+                    responsejson = {ERROR: {"status": status, "message": message or response.reason}}
+                elif not responsejson:
+                    status = None
+                    responsejson = {ERROR: {"status": "unknown", "message": "received an empty response"}}
+            except json.decoder.JSONDecodeError:
+                responsejson = {ERROR: {"status": status, "message": "received an unreadable response"}}
+                status = None if response.ok else status
+            except requests.RequestException as e:
+                responsetext = ''
+                responsejson = {ERROR: {"status": "unknown", "message": str(e)}}
+            
+            if ERROR not in responsejson:
+                policy.success()
+                # only reached with a 2xx status, error responses are never cached
+                if ttl is not None:
+                    cache.put(cache_key, responsetext, response.headers.get('ETag'), ttl)
+                return responsetext, responsejson
+            
+            error = responsejson[ERROR]
+            retryable = policy.is_retryable(status)
+            if retryable and policy.failure():
+                Printer.print(PrintChannel.WARNINGS, f"###   SPOTIFY API KEEPS FAILING, PAUSING REQUESTS FOR {policy.breaker_cooldown:.0f} SECONDS   ###")
+            # a 429 already holds back HttpClient for as long as Retry-After asks
+            delay = 0.0 if status == TOO_MANY_REQUESTS else policy.delay(attempt)
+            if (not retryable or attempt >= max(cls.CONFIG.get_retry_attempts(), MIN_RETRY_ATTEMPTS) - 1
+                or time.monotonic() + delay > deadline):
+                Printer.print(PrintChannel.API_ERRORS, f"Spotify API Error ({error['status']}): {error['message']}")
+                return responsetext, responsejson
+            
+            Printer.print(PrintChannel.WARNINGS, f"Spotify API Error (try {attempt + 1}) ({error['status']}): {error['message']}")
+            time.sleep(delay)
+            attempt += 1
     
     @classmethod
     def check_premium(cls) -> bool: